@@ -0,0 +1,234 @@
+# End-to-end benchmark for the reel pipeline.
+#
+# Builds synthetic fixtures in a scratch workspace (generated images, the stub TTS backend, so no
+# network is needed), times each stage and writes the results as JSON. Pass --baseline to compare
+# against an earlier run:
+#
+#     python benchmarks/bench_pipeline.py --images 5 --resolution 4000x3000 --output bench.json
+#     python benchmarks/bench_pipeline.py --baseline bench.json --threshold 0.15
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+from contextlib import contextmanager
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GALLERY_SIZES = (10, 1000, 10000)
+DESCRIPTION = (
+    "The Taj Mahal is an ivory-white marble mausoleum on the right bank of the river Yamuna in Agra. "
+    "It was commissioned in 1631 by the fifth Mughal emperor, Shah Jahan. "
+    "It is widely recognised as the jewel of Muslim art in India and one of the universally admired "
+    "masterpieces of the world's heritage."
+)
+
+
+def _rusage():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own, children
+
+
+def _peak_rss_mb(usage):
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    scale = 1024 * 1024 if platform.system() == "Darwin" else 1024
+    return round(usage.ru_maxrss / scale, 1)
+
+
+class Recorder:
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        own_before, children_before = _rusage()
+        start = time.perf_counter()
+        yield
+        wall = time.perf_counter() - start
+        own_after, children_after = _rusage()
+        cpu = (own_after.ru_utime - own_before.ru_utime + own_after.ru_stime - own_before.ru_stime)
+        child_cpu = (children_after.ru_utime - children_before.ru_utime
+                     + children_after.ru_stime - children_before.ru_stime)
+        self.stages[name] = {
+            "wall_s": round(wall, 4),
+            "cpu_s": round(cpu, 4),
+            "child_cpu_s": round(child_cpu, 4),
+            # High-water marks since process start, not per stage
+            "peak_rss_mb": _peak_rss_mb(own_after),
+            "peak_child_rss_mb": _peak_rss_mb(children_after),
+        }
+        print(f"{name:32s} wall {wall:8.3f}s  cpu {cpu:7.3f}s  children {child_cpu:7.3f}s", flush=True)
+
+
+def make_images(folder, count, size):
+    from PIL import Image
+    names = []
+    for i in range(count):
+        # Noise over a gradient: realistic entropy for JPEG and x264 without shipping fixtures
+        noise = Image.effect_noise(size, 40 + i).convert("RGB")
+        gradient = Image.linear_gradient("L").resize(size).convert("RGB")
+        img = Image.blend(noise, gradient, 0.5)
+        name = f"img{i}.jpg"
+        img.save(os.path.join(folder, name), "JPEG", quality=90)
+        names.append(name)
+    return names
+
+
+def write_job_folder(reel_id, image_names):
+    folder = os.path.join("user_upload", reel_id)
+    with open(os.path.join(folder, "dec.txt"), "w", encoding='utf-8') as f:
+        f.write(DESCRIPTION)
+    with open(os.path.join(folder, "input.txt"), "w", encoding='utf-8') as f:
+        for name in image_names:
+            f.write(f"file '{name}'\n")
+
+
+def bench_pipeline(recorder, args):
+    import text_to_audio
+    import media_probe
+    import image_prep
+    from reel import generate_reel
+
+    text_to_audio.set_backend("stub")
+    reel_id = "bench-reel"
+    folder = os.path.join("user_upload", reel_id)
+    os.makedirs(folder, exist_ok=True)
+    width, height = args.resolution
+    image_names = make_images(folder, args.images, (width, height))
+    write_job_folder(reel_id, image_names)
+    image_paths = [os.path.join(folder, name) for name in image_names]
+
+    with recorder.stage("tts_cold"):
+        assert text_to_audio.text_to_speech_with_gtts(DESCRIPTION, reel_id)
+    with recorder.stage("tts_cached"):
+        assert text_to_audio.text_to_speech_with_gtts(DESCRIPTION, reel_id)
+
+    with recorder.stage("validate_audio"):
+        assert media_probe.is_valid_audio(media_probe.probe(os.path.join(folder, "audio.mp3")))
+    with recorder.stage("normalize_images_cold"):
+        normalized = image_prep.normalize_images(image_paths)
+    with recorder.stage("normalize_images_cached"):
+        image_prep.normalize_images(image_paths)
+
+    with recorder.stage(f"encode_{args.profile}"):
+        assert generate_reel(reel_id, threads=args.threads, profile=args.profile)
+    if args.renditions:
+        with recorder.stage(f"encode_{args.profile}_renditions"):
+            assert generate_reel(reel_id, threads=args.threads, profile=args.profile, renditions=True)
+
+    with recorder.stage("thumbnail"):
+        image_prep.make_thumbnail(normalized[0], os.path.join("static", "reels", "thumbnails", "bench.jpg"))
+
+
+def bench_gallery(recorder, sizes):
+    import job_store
+    import gallery_index
+    import main
+
+    client = main.app.test_client()
+    for size in sizes:
+        job_store.JOB_DB_PATH = f"gallery-{size}.db"
+        now = time.time()
+        conn = gallery_index.get_connection()
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO reels (id, file, title, thumbnail, renditions, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, NULL, ?, ?)",
+            [(f"reel-{i}", f"reel-{i}.mp4", f"Reel number {i}", gallery_index.FALLBACK_THUMBNAIL,
+              now - i, now - i) for i in range(size)],
+        )
+        conn.execute("COMMIT")
+        with recorder.stage(f"gallery_render_{size}"):
+            response = client.get("/gallery")
+            assert response.status_code == 200
+        with recorder.stage(f"gallery_revalidate_{size}"):
+            assert client.get("/gallery", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+        with recorder.stage(f"gallery_last_page_{size}"):
+            assert client.get(f"/gallery?page={max(1, -(-size // main.GALLERY_PER_PAGE))}").status_code == 200
+
+
+def compare(results, baseline, threshold):
+    # Returns the stages whose wall time regressed by more than threshold (a fraction)
+    regressions = []
+    print(f"\n{'stage':32s} {'baseline':>10s} {'current':>10s} {'change':>8s}")
+    for name, current in results["stages"].items():
+        before = baseline.get("stages", {}).get(name)
+        if not before or not before["wall_s"]:
+            continue
+        change = (current["wall_s"] - before["wall_s"]) / before["wall_s"]
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"{name:32s} {before['wall_s']:10.3f} {current['wall_s']:10.3f} {change:+8.1%}{flag}")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def parse_resolution(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the reel pipeline on synthetic fixtures")
+    parser.add_argument("--images", type=int, default=5, help="Images per reel")
+    parser.add_argument("--resolution", type=parse_resolution, default=(4000, 3000), help="Source image size, WxH")
+    parser.add_argument("--profile", default="standard", help="Encoder profile to benchmark")
+    parser.add_argument("--renditions", action="store_true", help="Also benchmark the rendition ladder")
+    parser.add_argument("--threads", type=int, default=None, help="ffmpeg threads for the encode")
+    parser.add_argument("--gallery-sizes", type=int, nargs="*", default=list(GALLERY_SIZES))
+    parser.add_argument("--output", default=None, help="Write results JSON here")
+    parser.add_argument("--baseline", default=None, help="Compare against this results JSON")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed wall-time regression (fraction)")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch workspace")
+    parser.add_argument("--log-level", default="WARNING", help="Pipeline log level during the run")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    # The pipeline works with paths relative to the working directory, so run it in a scratch copy
+    workspace = tempfile.mkdtemp(prefix="vidsnap-bench-")
+    shutil.copytree(os.path.join(REPO_ROOT, "templates"), os.path.join(workspace, "templates"))
+    os.makedirs(os.path.join(workspace, "static", "images"))
+    os.chdir(workspace)
+    sys.path.insert(0, REPO_ROOT)
+    # Time the pipeline alone, without the web app's background storage sweeps
+    os.environ["STORAGE_SWEEP_INTERVAL"] = "0"
+
+    logging.basicConfig(level=args.log_level)
+    recorder = Recorder()
+    try:
+        bench_pipeline(recorder, args)
+        bench_gallery(recorder, args.gallery_sizes)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    results = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "params": {
+            "images": args.images, "resolution": list(args.resolution), "profile": args.profile,
+            "renditions": args.renditions, "threads": args.threads, "gallery_sizes": args.gallery_sizes,
+        },
+        "stages": recorder.stages,
+    }
+    if output:
+        with open(output, "w", encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nWrote results to {output}")
+    if baseline_path:
+        with open(baseline_path, "r", encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} stages regressed: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+import os
+import uuid
+import shutil
+import hashlib
+import logging
+
+# Content-addressed store for uploaded images. Uploads are streamed to disk in chunks while
+# being hashed, and per-reel folders hard-link the blob instead of keeping their own copy.
+BLOB_DIR = os.environ.get("BLOB_DIR", "blobs")
+CHUNK_SIZE = 256 * 1024
+
+# Leading bytes of the formats we accept, mapped to their allowed extensions
+MAGIC_NUMBERS = {
+    b"\xff\xd8\xff": {"jpg", "jpeg"},
+    b"\x89PNG\r\n\x1a\n": {"png"},
+}
+
+
+class InvalidUpload(Exception):
+    pass
+
+
+def sniff_extensions(head):
+    for magic, extensions in MAGIC_NUMBERS.items():
+        if head.startswith(magic):
+            return extensions
+    return None
+
+
+def blob_path(digest):
+    return os.path.join(BLOB_DIR, digest[:2], digest)
+
+
+def link_or_copy(src, dest):
+    # Materialize src at dest without duplicating bytes when the filesystem allows it
+    tmp = f"{dest}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+    return dest
+
+
+def ingest_upload(stream, extension):
+    # Streams an uploaded image into the store and returns (blob path, whether it was new).
+    # Raises InvalidUpload if the content is not an image of the claimed type.
+    os.makedirs(BLOB_DIR, exist_ok=True)
+    head = stream.read(CHUNK_SIZE)
+    allowed = sniff_extensions(head)
+    if not allowed or extension.lower() not in allowed:
+        raise InvalidUpload("file content is not a PNG or JPEG image matching its extension")
+
+    digest = hashlib.sha256()
+    tmp = os.path.join(BLOB_DIR, f".upload.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp, "wb") as out:
+            chunk = head
+            while chunk:
+                digest.update(chunk)
+                out.write(chunk)
+                chunk = stream.read(CHUNK_SIZE)
+        path = blob_path(digest.hexdigest())
+        if os.path.exists(path):
+            logging.info(f"Upload matches existing blob {digest.hexdigest()[:12]}")
+            return path, False
+        # Only content we have never seen needs a full image check
+        try:
+            from PIL import Image
+            with Image.open(tmp) as img:
+                img.verify()
+        except Exception as e:
+            raise InvalidUpload(str(e))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp, path)
+        return path, True
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
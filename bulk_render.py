@@ -0,0 +1,276 @@
+import os
+import csv
+import json
+import time
+import socket
+import hashlib
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from werkzeug.utils import secure_filename
+import job_store
+import blob_store
+import encoder_profiles
+from text_to_audio import text_to_speech_with_gtts
+from reel import generate_reel
+from ffmpeg_utils import terminate_all, thread_budget, deadline_after
+
+# Headless batch rendering from a manifest, through the same TTS and generate_reel code as the web app.
+#
+#     python bulk_render.py batch.jsonl --workers 2 --summary batch.summary.json
+#
+# Manifest rows (JSONL objects, or CSV with a header) have:
+#   images       list of image paths (CSV: separated by ";"), relative to the manifest
+#   description  narration text
+#   id           optional reel id; defaults to a hash of the row
+#   profile      optional encoder profile; renditions / hls optional booleans
+# Every finished item is appended to a checkpoint file, so rerunning the same command after an
+# interruption only renders what is left. Changing a row changes its fingerprint and re-renders it.
+UPLOAD_FOLDER = "user_upload"
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+TRUE_VALUES = {"1", "true", "yes", "on"}
+
+
+def read_manifest(path):
+    if path.lower().endswith(".csv"):
+        with open(path, "r", encoding='utf-8', newline='') as f:
+            rows = list(csv.DictReader(f))
+        for row in rows:
+            row["images"] = [p.strip() for p in (row.get("images") or "").split(";") if p.strip()]
+        return rows
+    rows = []
+    with open(path, "r", encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    rows.append(json.loads(line))
+                except ValueError as e:
+                    raise ValueError(f"{path}:{number}: {e}")
+    return rows
+
+
+def _flag(value):
+    return value if isinstance(value, bool) else str(value or "").strip().lower() in TRUE_VALUES
+
+
+def normalize_item(row, base_dir):
+    # Resolves paths and defaults; the fingerprint covers everything that affects the output
+    images = row.get("images") or []
+    if isinstance(images, str):
+        images = [p.strip() for p in images.split(";") if p.strip()]
+    item = {
+        "images": [os.path.normpath(os.path.join(base_dir, p)) for p in images],
+        "description": (row.get("description") or row.get("text") or "").strip(),
+        "profile": row.get("profile") or encoder_profiles.DEFAULT_PROFILE,
+        "renditions": _flag(row.get("renditions")),
+        "hls": _flag(row.get("hls")) if row.get("hls") not in (None, "") else None,
+    }
+    digest = hashlib.sha256()
+    digest.update(json.dumps(item, sort_keys=True).encode("utf-8"))
+    for image in item["images"]:
+        try:
+            st = os.stat(image)
+            digest.update(f"{st.st_size}:{st.st_mtime_ns}".encode("utf-8"))
+        except FileNotFoundError:
+            pass
+    item["fingerprint"] = digest.hexdigest()
+    item["id"] = secure_filename(str(row.get("id") or "")) or f"bulk-{item['fingerprint'][:16]}"
+    return item
+
+
+def load_checkpoint(path):
+    # id -> last checkpoint record; later lines win
+    done = {}
+    try:
+        with open(path, "r", encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # A torn last line from an interrupted run
+                done[record["id"]] = record
+    except FileNotFoundError:
+        pass
+    return done
+
+
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def record(self, entry):
+        with self.lock:
+            with open(self.path, "a", encoding='utf-8') as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def validate_item(item):
+    if not item["description"]:
+        return "missing description"
+    if not item["images"]:
+        return "no images"
+    if item["profile"] not in encoder_profiles.ENCODER_PROFILES:
+        return f"unknown profile {item['profile']}"
+    for image in item["images"]:
+        extension = image.rsplit('.', 1)[1].lower() if '.' in image else ''
+        if extension not in ALLOWED_EXTENSIONS:
+            return f"unsupported image type {image}"
+        if not os.path.isfile(image):
+            return f"image not found {image}"
+    return None
+
+
+def stage_folder(item):
+    # Lays the item out exactly like a web upload: blob-store links, dec.txt and input.txt
+    folder_path = os.path.join(UPLOAD_FOLDER, item["id"])
+    os.makedirs(folder_path, exist_ok=True)
+    names = []
+    for index, image in enumerate(item["images"]):
+        extension = image.rsplit('.', 1)[1].lower()
+        name = f"{index:03d}_{secure_filename(os.path.basename(image))}"
+        with open(image, "rb") as stream:
+            blob, _ = blob_store.ingest_upload(stream, extension)
+        blob_store.link_or_copy(blob, os.path.join(folder_path, name))
+        names.append(name)
+    with open(os.path.join(folder_path, "dec.txt"), "w", encoding='utf-8') as f:
+        f.write(item["description"])
+    with open(os.path.join(folder_path, "input.txt"), "w", encoding='utf-8') as f:
+        for name in names:
+            f.write(f"file '{name}'\n")
+
+
+def render_item(item, owner, threads, timeout):
+    # Returns (status, error). The folder is leased in the job store so generate_process.py
+    # workers leave it alone while it renders here.
+    error = validate_item(item)
+    if error:
+        return "failed", error
+    if not job_store.claim_folder(item["id"], owner):
+        return "skipped", "leased by another worker"
+    renewed = [time.time()]
+    deadline = deadline_after(timeout)  # One budget for the whole item, TTS and encode together
+
+    def keep_lease(report):
+        # Encode progress reports double as a heartbeat for long encodes
+        if time.time() - renewed[0] >= job_store.DEFAULT_LEASE_SECONDS / 3:
+            job_store.renew_lease(item["id"], owner)
+            renewed[0] = time.time()
+
+    try:
+        stage_folder(item)
+        if not text_to_speech_with_gtts(item["description"], item["id"], deadline=deadline):
+            error = "tts failed"
+        elif not job_store.renew_lease(item["id"], owner):
+            # Renewed between stages so a long item keeps its lease; losing it means another worker took over
+            return "skipped", "lease lost"
+        elif not generate_reel(item["id"], threads=threads, deadline=deadline, profile=item["profile"],
+                               renditions=item["renditions"], hls=item["hls"], on_progress=keep_lease):
+            error = "encode failed"
+    except blob_store.InvalidUpload as e:
+        error = f"invalid image: {e}"
+    except Exception as e:
+        logging.exception(f"Item {item['id']} crashed: {e}")
+        error = str(e)
+    if error:
+        # Terminal in the job store too, so generate_process.py workers don't retry what the
+        # summary reports as failed; --retry-failed re-claims it
+        job_store.mark_failed(item["id"], error, 1)
+        return "failed", error
+    job_store.mark_done(item["id"])
+    return "done", None
+
+
+def _timed_render(item, owner, threads, timeout):
+    start = time.time()
+    status, error = render_item(item, owner, threads, timeout)
+    return status, error, round(time.time() - start, 3)
+
+
+def run_batch(manifest, workers=1, cpu_budget=None, timeout=None, checkpoint_path=None, retry_failed=False):
+    base_dir = os.path.dirname(os.path.abspath(manifest))
+    items = [normalize_item(row, base_dir) for row in read_manifest(manifest)]
+    checkpoint_path = checkpoint_path or f"{manifest}.checkpoint.jsonl"
+    previous = load_checkpoint(checkpoint_path)
+    checkpoint = Checkpoint(checkpoint_path)
+    owner = f"bulk-{socket.gethostname()}-{os.getpid()}"
+    threads = thread_budget(cpu_budget, workers)
+
+    results = {}
+    duplicates = []
+    pending = []
+    seen = set()
+    for item in items:
+        if item["id"] in seen:
+            duplicates.append({"id": item["id"], "status": "failed", "error": "duplicate id in manifest"})
+            continue
+        seen.add(item["id"])
+        last = previous.get(item["id"])
+        if last and last["fingerprint"] == item["fingerprint"] and (
+                last["status"] == "done" or (last["status"] == "failed" and not retry_failed)):
+            results[item["id"]] = dict(last, resumed=True)
+        else:
+            pending.append(item)
+    logging.info(f"{len(items)} items in {manifest}: {len(items) - len(pending)} already finished, "
+                 f"{len(pending)} to render with {workers} workers x {threads} threads")
+
+    started = time.time()
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk")
+    futures = {}
+    for item in pending:
+        futures[pool.submit(_timed_render, item, owner, threads, timeout)] = item
+    try:
+        for future in as_completed(futures):
+            item = futures[future]
+            status, error, duration = future.result()
+            entry = {"id": item["id"], "status": status, "error": error, "duration_s": duration,
+                     "fingerprint": item["fingerprint"], "finished_at": time.time()}
+            if status != "skipped":
+                checkpoint.record(entry)
+            results[item["id"]] = entry
+            logging.info(f"[{len(results)}/{len(items)}] {item['id']}: {status}{f' ({error})' if error else ''}")
+    except KeyboardInterrupt:
+        logging.warning("Interrupted; finished items are checkpointed, rerun to resume")
+        pool.shutdown(wait=False, cancel_futures=True)
+        terminate_all()
+        for item in futures.values():
+            job_store.release(item["id"], owner, delay=0)
+        raise
+    pool.shutdown()
+
+    ordered = [results[item_id] for item_id in dict.fromkeys(item["id"] for item in items) if item_id in results]
+    ordered += duplicates
+    counts = {}
+    for entry in ordered:
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+    return {
+        "manifest": os.path.abspath(manifest),
+        "started_at": started,
+        "duration_s": round(time.time() - started, 3),
+        "counts": counts,
+        "items": ordered,
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Render every reel listed in a JSONL or CSV manifest")
+    parser.add_argument("manifest", help="JSONL or CSV manifest")
+    parser.add_argument("--workers", type=int, default=1, help="Items rendered concurrently")
+    parser.add_argument("--cpu-budget", type=int, default=None, help="Total cores shared by all encodes (default: all)")
+    parser.add_argument("--timeout", type=int, default=900, help="Per-item timeout in seconds")
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint file (default: <manifest>.checkpoint.jsonl)")
+    parser.add_argument("--summary", default=None, help="Write the JSON summary here (default: stdout)")
+    parser.add_argument("--retry-failed", action="store_true", help="Render items that failed in an earlier run again")
+    args = parser.parse_args()
+    summary = run_batch(args.manifest, args.workers, args.cpu_budget, args.timeout, args.checkpoint, args.retry_failed)
+    if args.summary:
+        with open(args.summary, "w", encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        logging.info(f"Wrote summary to {args.summary}: {summary['counts']}")
+    else:
+        print(json.dumps(summary, indent=2))
+    raise SystemExit(1 if summary["counts"].get("failed") else 0)
@@ -0,0 +1,43 @@
+import os
+
+# Named encoding profiles, selectable per job. width/height is the top rendition's canvas.
+# preset/crf drive libx264; video_bitrate is the target for encoders without CRF (see ffmpeg_caps).
+ENCODER_PROFILES = {
+    "draft": {"preset": "veryfast", "crf": 30, "video_bitrate": "1500k", "width": 720, "height": 1280,
+              "audio_bitrate": "96k"},
+    "standard": {"preset": "medium", "crf": 23, "video_bitrate": "4M", "width": 1080, "height": 1920,
+                 "audio_bitrate": "128k"},
+    "archive": {"preset": "slow", "crf": 18, "video_bitrate": "8M", "width": 1080, "height": 1920,
+                "audio_bitrate": "192k"},
+}
+DEFAULT_PROFILE = os.environ.get("REEL_PROFILE", "standard")
+
+# Vertical (9:16) output ladder, largest first
+RENDITIONS = (
+    ("1080p", 1080, 1920),
+    ("720p", 720, 1280),
+    ("480p", 480, 854),
+)
+
+
+def get_profile(name=None):
+    name = name or DEFAULT_PROFILE
+    if name not in ENCODER_PROFILES:
+        raise ValueError(f"Unknown encoder profile {name!r}, expected one of {sorted(ENCODER_PROFILES)}")
+    return dict(ENCODER_PROFILES[name], name=name)
+
+
+def rendition_ladder(profile, renditions=False):
+    # The profile's own size first, then every smaller ladder step when renditions are requested
+    top = (profile["width"], profile["height"])
+    ladder = [(label, w, h) for label, w, h in RENDITIONS if (w, h) == top]
+    if not ladder:
+        ladder = [(f"{top[0]}p", *top)]
+    if renditions:
+        ladder += [(label, w, h) for label, w, h in RENDITIONS if h < top[1]]
+    return ladder
+
+
+def rendition_filename(reel_id, label, index):
+    # The top rendition keeps the historical <id>.mp4 name so existing links keep working
+    return f"{reel_id}.mp4" if index == 0 else f"{reel_id}_{label}.mp4"
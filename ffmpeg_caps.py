@@ -0,0 +1,123 @@
+import os
+import re
+import json
+import uuid
+import shutil
+import logging
+import threading
+import subprocess
+
+# What the installed ffmpeg can do, probed once per binary and cached on disk. The record is keyed
+# on the binary's resolved path, size and mtime, so upgrading ffmpeg invalidates it and every
+# other process start reads a small JSON file instead of spawning ffmpeg.
+FFMPEG_CAPS_FILE = os.environ.get("FFMPEG_CAPS_FILE", os.path.join("cache", "ffmpeg_caps.json"))
+PROBE_TIMEOUT = 30
+# Options the pipeline relies on, checked against `ffmpeg -h full`
+OPTIONS_OF_INTEREST = ("progress", "movflags", "force_key_frames", "filter_complex_threads", "hls_segment_type")
+# H.264 encoders in order of preference; only software encoders, since a listed hardware encoder
+# says nothing about whether the device is actually present
+H264_ENCODERS = ("libx264", "libopenh264")
+
+_ENCODER_RE = re.compile(r"^\s*([VAS])[\w.]{5}\s+(\w\S*)", re.MULTILINE)
+_FILTER_RE = re.compile(r"^\s*[\w.|]{2,3}\s+(\S+)\s+\S+->\S+", re.MULTILINE)
+
+_caps = None
+_lock = threading.Lock()
+
+
+def _binary_signature(binary):
+    path = os.path.realpath(binary)
+    st = os.stat(path)
+    return {"path": path, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _run(binary, *args):
+    return subprocess.run([binary, "-hide_banner", *args], capture_output=True, text=True,
+                          timeout=PROBE_TIMEOUT).stdout
+
+
+def probe_capabilities(binary):
+    version = _run(binary, "-version").splitlines()
+    encoders = {"video": [], "audio": []}
+    for kind, name in _ENCODER_RE.findall(_run(binary, "-encoders")):
+        if kind == "V":
+            encoders["video"].append(name)
+        elif kind == "A":
+            encoders["audio"].append(name)
+    filters = sorted(set(_FILTER_RE.findall(_run(binary, "-filters"))))
+    help_text = _run(binary, "-h", "full")
+    options = {name: re.search(rf"^\s*-{re.escape(name)}[\s\[:]", help_text, re.MULTILINE) is not None
+               for name in OPTIONS_OF_INTEREST}
+    return {
+        "version": version[0] if version else None,
+        "encoders": encoders,
+        "filters": filters,
+        "options": options,
+        "ffprobe": shutil.which("ffprobe"),
+    }
+
+
+def _load(path):
+    try:
+        with open(path, "r", encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save(path, record):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "w", encoding='utf-8') as f:
+        json.dump(record, f, indent=1)
+    os.replace(tmp, path)
+
+
+def get_capabilities(refresh=False):
+    # Returns the capability record, or None when ffmpeg is not installed
+    global _caps
+    with _lock:
+        if _caps is not None and not refresh:
+            return _caps
+        binary = shutil.which("ffmpeg")
+        if binary is None:
+            logging.error("FFmpeg not found in PATH")
+            return None
+        signature = _binary_signature(binary)
+        record = None if refresh else _load(FFMPEG_CAPS_FILE)
+        # Reprobe for a new binary, or when an option was added to OPTIONS_OF_INTEREST since the record was written
+        if (not record or record.get("binary") != signature
+                or set(OPTIONS_OF_INTEREST) - set(record.get("options", {}))):
+            try:
+                record = dict(probe_capabilities(binary), binary=signature)
+            except (OSError, subprocess.SubprocessError) as e:
+                logging.error(f"FFmpeg capability probe failed: {e}")
+                return None
+            try:
+                _save(FFMPEG_CAPS_FILE, record)
+            except OSError as e:
+                logging.warning(f"Could not cache FFmpeg capabilities: {e}")
+            logging.info(f"Probed {record['version']}: {len(record['encoders']['video'])} video encoders, "
+                         f"{len(record['filters'])} filters")
+        _caps = record
+        return _caps
+
+
+def has_encoder(name):
+    caps = get_capabilities() or {}
+    encoders = caps.get("encoders", {})
+    return name in encoders.get("video", []) or name in encoders.get("audio", [])
+
+
+def has_option(name):
+    # Unknown (no record) counts as supported, so a failed probe doesn't disable features
+    caps = get_capabilities()
+    return True if caps is None else caps["options"].get(name, True)
+
+
+def video_encoder():
+    # Best available H.264 encoder; libx264 when nothing better is known
+    for name in H264_ENCODERS:
+        if has_encoder(name):
+            return name
+    return H264_ENCODERS[0]
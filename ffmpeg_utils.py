@@ -0,0 +1,181 @@
+import os
+import time
+import signal
+import logging
+import threading
+import subprocess
+import ffmpeg_caps
+
+# Live ffmpeg children, so a shutting-down worker can cancel encodes that are still running
+_children = set()
+_children_lock = threading.Lock()
+# Set by terminate_all(); no new ffmpeg process starts afterwards, so threads that were between
+# stages wind down instead of rendering a folder the store has already handed back
+_cancelled = threading.Event()
+
+
+class FFmpegError(Exception):
+    def __init__(self, message, stderr=""):
+        super().__init__(message)
+        self.stderr = stderr
+
+
+def _kill_process_group(proc, sig=signal.SIGKILL):
+    try:
+        os.killpg(proc.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def parse_progress(block, duration=None):
+    # Turns one -progress key=value block into fps, speed and percent done
+    out_time_us = block.get("out_time_us") or block.get("out_time_ms") or "0"
+    try:
+        out_time = int(out_time_us) / 1_000_000
+    except ValueError:
+        out_time = 0.0
+    try:
+        fps = float(block.get("fps", 0) or 0)
+    except ValueError:
+        fps = 0.0
+    try:
+        speed = float((block.get("speed") or "0").rstrip("x") or 0)
+    except ValueError:
+        speed = 0.0
+    report = {"frame": int(block.get("frame", 0) or 0), "fps": fps, "speed": speed, "out_time_s": out_time}
+    if block.get("progress") == "end":
+        report["percent"] = 100.0
+    elif duration:
+        report["percent"] = round(min(100.0, 100.0 * out_time / duration), 1)
+    return report
+
+
+def deadline_after(timeout):
+    # A job deadline on the monotonic clock, or None for no limit
+    return time.monotonic() + timeout if timeout else None
+
+
+def time_left(deadline):
+    # Seconds until deadline (None when there is none); raises FFmpegError once it has passed
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise FFmpegError("Job deadline exceeded")
+    return left
+
+
+def cap_timeout(timeout, deadline):
+    # The smaller of a per-call timeout and the time left before deadline
+    left = time_left(deadline)
+    if left is None:
+        return timeout
+    return left if timeout is None else min(timeout, left)
+
+
+def run_ffmpeg(args, timeout=None, on_progress=None, duration=None, deadline=None):
+    # Runs ffmpeg (args excludes the binary name) in its own process group and returns its stdout.
+    # On timeout, or once deadline (see deadline_after) passes, the whole group is killed so no
+    # stuck encoder outlives the job. When on_progress
+    # is given, ffmpeg's machine-readable -progress output is parsed and reported as it arrives;
+    # duration (seconds of expected output) lets the reports include a percentage.
+    command = ["ffmpeg", "-hide_banner", "-y"]
+    if on_progress and ffmpeg_caps.has_option("progress"):
+        command += ["-progress", "pipe:1", "-nostats"]
+    command += list(args)
+    timeout = cap_timeout(timeout, deadline)
+    if _cancelled.is_set():
+        raise FFmpegError("FFmpeg cancelled: shutting down")
+    logging.info(f"Running FFmpeg command: {subprocess.list2cmdline(command)}")
+    proc = subprocess.Popen(
+        command,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        start_new_session=True,
+    )
+    with _children_lock:
+        _children.add(proc)
+        if _cancelled.is_set():
+            # terminate_all() ran while this process was starting
+            _kill_process_group(proc)
+    try:
+        if on_progress:
+            stdout, stderr, timed_out = _follow_progress(proc, timeout, on_progress, duration)
+        else:
+            timed_out = False
+            try:
+                stdout, stderr = proc.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                _kill_process_group(proc)
+                stdout, stderr = proc.communicate()
+                timed_out = True
+    finally:
+        with _children_lock:
+            _children.discard(proc)
+    if timed_out:
+        raise FFmpegError(f"FFmpeg timed out after {timeout}s", stderr)
+    if proc.returncode != 0:
+        raise FFmpegError(f"FFmpeg exited with code {proc.returncode}", stderr)
+    return stdout
+
+
+def _follow_progress(proc, timeout, on_progress, duration):
+    # stderr is drained on a helper thread so a chatty encoder can't block on a full pipe
+    stderr_chunks = []
+    drain = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()), daemon=True)
+    drain.start()
+    timed_out = threading.Event()
+
+    def kill_on_timeout():
+        timed_out.set()
+        _kill_process_group(proc)
+
+    timer = threading.Timer(timeout, kill_on_timeout) if timeout else None
+    if timer:
+        timer.daemon = True
+        timer.start()
+    block = {}
+    try:
+        for line in proc.stdout:
+            key, _, value = line.strip().partition("=")
+            block[key] = value
+            if key == "progress":
+                try:
+                    on_progress(parse_progress(block, duration))
+                except Exception as e:
+                    logging.warning(f"Progress callback failed: {e}")
+                block = {}
+        proc.wait()
+    finally:
+        if timer:
+            timer.cancel()
+    drain.join()
+    return "", "".join(stderr_chunks), timed_out.is_set()
+
+
+def terminate_all():
+    # Ask running encodes to stop, then kill whatever is left. Later run_ffmpeg calls fail at once.
+    with _children_lock:
+        _cancelled.set()
+        children = list(_children)
+    for proc in children:
+        _kill_process_group(proc, signal.SIGTERM)
+    for proc in children:
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            _kill_process_group(proc)
+    if children:
+        logging.warning(f"Cancelled {len(children)} running FFmpeg processes")
+
+
+def cancelled():
+    return _cancelled.is_set()
+
+
+def thread_budget(cpu_budget, concurrency):
+    # Split a total core budget across concurrent encodes so they don't oversubscribe the CPU
+    cpu_budget = cpu_budget or os.cpu_count() or 1
+    return max(1, cpu_budget // max(1, concurrency))
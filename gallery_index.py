@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import logging
+import threading
+import job_store
+import encoder_profiles
+
+# Persistent gallery manifest. Finished renders upsert their row, so listing the gallery is an
+# indexed, paginated query instead of a directory scan plus a dec.txt read per reel.
+REELS_DIR = os.path.join("static", "reels")
+FALLBACK_THUMBNAIL = "images/fallback.jpg"
+TITLE_LENGTH = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reels (
+    id TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    title TEXT NOT NULL,
+    thumbnail TEXT NOT NULL,
+    creator TEXT NOT NULL DEFAULT 'Anonymous',
+    renditions TEXT,
+    playlist TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_reels_created ON reels (created_at DESC);
+"""
+
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+
+def get_connection(db_path=None):
+    conn = job_store.get_connection(db_path)
+    key = db_path or job_store.JOB_DB_PATH
+    if key not in _schema_ready:
+        with _schema_lock:
+            conn.executescript(SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(reels)")}
+            if "renditions" not in columns:
+                conn.execute("ALTER TABLE reels ADD COLUMN renditions TEXT")
+            if "playlist" not in columns:
+                conn.execute("ALTER TABLE reels ADD COLUMN playlist TEXT")
+            _schema_ready.add(key)
+    return conn
+
+
+def _read_title(reel_id):
+    dec_file = os.path.join("user_upload", reel_id, "dec.txt")
+    try:
+        with open(dec_file, "r", encoding='utf-8') as df:
+            return df.read().strip()[:TITLE_LENGTH] or "Untitled"
+    except FileNotFoundError:
+        return "Untitled"
+    except Exception as e:
+        logging.error(f"Error reading description file {dec_file}: {e}")
+        return "Untitled"
+
+
+def _thumbnail_for(reel_id):
+    thumbnail = f"reels/thumbnails/{reel_id}.jpg"
+    return thumbnail if os.path.exists(os.path.join("static", thumbnail)) else FALLBACK_THUMBNAIL
+
+
+def add_reel(reel_id, title=None, created_at=None, renditions=None, playlist=None, db_path=None):
+    # renditions: [{"label", "width", "height", "file"}], largest first;
+    # playlist: HLS master playlist relative to REELS_DIR, if one was packaged
+    now = time.time()
+    renditions = renditions or [{"label": "source", "width": None, "height": None, "file": f"{reel_id}.mp4"}]
+    get_connection(db_path).execute(
+        "INSERT INTO reels (id, file, title, thumbnail, renditions, playlist, created_at, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(id) DO UPDATE SET file = excluded.file, title = excluded.title, "
+        "thumbnail = excluded.thumbnail, renditions = excluded.renditions, playlist = excluded.playlist, "
+        "updated_at = excluded.updated_at",
+        (reel_id, renditions[0]["file"], title or _read_title(reel_id), _thumbnail_for(reel_id),
+         json.dumps(renditions), playlist, created_at or now, now),
+    )
+    logging.info(f"Added reel {reel_id} to gallery index")
+
+
+def list_reels(page=1, per_page=24, db_path=None):
+    offset = (max(1, page) - 1) * per_page
+    rows = get_connection(db_path).execute(
+        "SELECT id, file, title, thumbnail, creator, renditions, playlist, created_at FROM reels "
+        "ORDER BY created_at DESC, id LIMIT ? OFFSET ?",
+        (per_page, offset),
+    ).fetchall()
+    reels = []
+    for row in rows:
+        reel = dict(row)
+        reel["renditions"] = json.loads(reel["renditions"]) if reel["renditions"] else [
+            {"label": "source", "width": None, "height": None, "file": reel["file"]}
+        ]
+        reels.append(reel)
+    return reels
+
+
+def pick_rendition(renditions, min_width):
+    # Smallest rendition at least min_width pixels wide, else the largest one available
+    sized = [r for r in renditions if r.get("width")]
+    suitable = [r for r in sized if r["width"] >= min_width]
+    if suitable:
+        return min(suitable, key=lambda r: r["width"])
+    return max(sized, key=lambda r: r["width"]) if sized else renditions[0]
+
+
+def get_version(db_path=None):
+    # (reel count, last modification time): changes whenever a reel is added or re-rendered
+    row = get_connection(db_path).execute("SELECT COUNT(*) AS n, MAX(updated_at) AS last FROM reels").fetchone()
+    return row["n"], row["last"] or 0.0
+
+
+def _is_rendition_file(name):
+    # <id>_720p.mp4 and friends are smaller renditions of <id>.mp4, not reels of their own
+    stem = name[:-len(".mp4")]
+    for label, _, _ in encoder_profiles.RENDITIONS:
+        base = stem[:-len(label) - 1]
+        if stem.endswith(f"_{label}") and os.path.exists(os.path.join(REELS_DIR, f"{base}.mp4")):
+            return True
+    return False
+
+
+def backfill_from_disk(db_path=None):
+    # One-time import of reels rendered before the index existed
+    if job_store.get_meta("gallery_backfilled", db_path=db_path):
+        return 0
+    count = 0
+    try:
+        with os.scandir(REELS_DIR) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".mp4"):
+                    if _is_rendition_file(entry.name):
+                        continue
+                    add_reel(entry.name[:-len(".mp4")], created_at=entry.stat().st_mtime, db_path=db_path)
+                    count += 1
+    except FileNotFoundError:
+        pass
+    job_store.set_meta("gallery_backfilled", time.time(), db_path)
+    logging.info(f"Backfilled {count} existing reels into the gallery index")
+    return count
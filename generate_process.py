@@ -1,127 +1,164 @@
 import os
 import time
 import logging
-import subprocess
+import signal
+import socket
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from text_to_audio import text_to_speech_with_gtts
-from pydub import AudioSegment
+import job_store
+import metrics
+import storage
+from reel import generate_reel
+import encoder_profiles
+from ffmpeg_utils import terminate_all, thread_budget, deadline_after
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Track failed attempts
+# Legacy bookkeeping files, imported once into the job store
+DONE_FILE = "done.txt"
 FAILED_ATTEMPTS_FILE = "failed_attempts.txt"
-MAX_ATTEMPTS = 3
-
-def load_failed_attempts():
-    try:
-        with open(FAILED_ATTEMPTS_FILE, "r", encoding='utf-8') as f:
-            return {line.strip().split(":")[0]: int(line.strip().split(":")[1]) for line in f if ":" in line}
-    except FileNotFoundError:
-        return {}
-
-def save_failed_attempt(folder, attempts):
-    failed_attempts = load_failed_attempts()
-    failed_attempts[folder] = attempts
-    with open(FAILED_ATTEMPTS_FILE, "w", encoding='utf-8') as f:
-        for folder_id, count in failed_attempts.items():
-            f.write(f"{folder_id}:{count}\n")
-
-def generate_reel(folder):
-    audio_file = os.path.normpath(os.path.join("user_upload", folder, "audio.mp3"))
-    output_file = os.path.normpath(os.path.join("static", "reels", f"{folder}.mp4"))
-    thumbnail_file = os.path.normpath(os.path.join("static", "reels", "thumbnails", f"{folder}.jpg"))
-    input_file = os.path.normpath(os.path.join("user_upload", folder, "input.txt"))
-
-    # Verify required files
-    if not os.path.exists(audio_file):
-        logging.error(f"Audio file {audio_file} does not exist")
-        return False
-    if not os.path.exists(input_file):
-        logging.error(f"Input file {input_file} does not exist")
-        return False
-
-    # Verify audio file
-    try:
-        AudioSegment.from_mp3(audio_file)
-        logging.info(f"Validated audio file: {audio_file}")
-    except Exception as e:
-        logging.error(f"Invalid audio file {audio_file}: {e}")
-        return False
-
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
-    os.makedirs(os.path.dirname(thumbnail_file), exist_ok=True)
-
-    # Generate reel
-    command = (
-        f'ffmpeg -stream_loop -1 -f concat -safe 0 -i "{input_file}" -i "{audio_file}" '
-        f'-vf "scale=1080:1920:force_original_aspect_ratio=decrease,pad=1080:1920:(ow-iw)/2:(oh-ih)/2:black" '
-        f'-c:v libx264 -c:a aac -shortest -r 30 -pix_fmt yuv420p "{output_file}"'
-    )
-    try:
-        result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
-        logging.info(f"Reel generated successfully: {output_file}")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"FFmpeg error (reel generation): {e.stderr}")
-        return False
-
-    # Generate thumbnail
-    thumbnail_command = (
-        f'ffmpeg -i "{output_file}" -vframes 1 -vf "scale=320:180:force_original_aspect_ratio=decrease" '
-        f'"{thumbnail_file}"'
-    )
-    try:
-        subprocess.run(thumbnail_command, shell=True, capture_output=True, text=True, check=True)
-        logging.info(f"Thumbnail generated successfully: {thumbnail_file}")
-        return True
-    except subprocess.CalledProcessError as e:
-        logging.error(f"FFmpeg error (thumbnail generation): {e.stderr}")
-        return False
+MAX_ATTEMPTS = job_store.MAX_ATTEMPTS
+POLL_INTERVAL = 5
+LEASE_SECONDS = job_store.DEFAULT_LEASE_SECONDS
+DEFAULT_JOB_TIMEOUT = 900
 
-if __name__ == "__main__":
-    while True:
-        logging.info("Processing folders...")
-        try:
-            with open("done.txt", "r", encoding='utf-8') as f:
-                done_folders = [line.strip() for line in f.readlines()]
-        except FileNotFoundError:
-            done_folders = []
-
-        failed_attempts = load_failed_attempts()
-        folders = os.listdir("user_upload")
-        for folder in folders:
-            if folder in done_folders:
-                logging.info(f"Skipping already processed folder: {folder}")
-                continue
-            if folder in failed_attempts and failed_attempts[folder] >= MAX_ATTEMPTS:
-                logging.warning(f"Skipping folder {folder}: Max attempts ({MAX_ATTEMPTS}) reached")
-                continue
-
-            logging.info(f"Processing folder: {folder}")
-            dec_file = os.path.normpath(os.path.join("user_upload", folder, "dec.txt"))
-            if not os.path.exists(dec_file):
-                logging.warning(f"No dec.txt found in folder {folder}. Skipping.")
-                continue
-            with open(dec_file, "r", encoding='utf-8') as f:
-                input_text = f.read().strip()
-            if not input_text:
-                logging.warning(f"No text in dec.txt for folder {folder}. Skipping.")
-                continue
-
-            audio_filepath = text_to_speech_with_gtts(input_text, folder)
-            if audio_filepath:
-                if generate_reel(folder):
-                    with open("done.txt", "a", encoding='utf-8') as f:
-                        f.write(f"{folder}\n")
+def prepare_audio(folder, job_timeout=None):
+    # I/O-bound stage: returns ("ok", seconds spent), "skip" when the upload is incomplete, or "failed".
+    # The job timeout covers this stage and the encode together; the encode gets what is left.
+    started = time.monotonic()
+    logging.info(f"Processing folder: {folder}")
+    dec_file = os.path.normpath(os.path.join("user_upload", folder, "dec.txt"))
+    if not os.path.exists(dec_file):
+        logging.warning(f"No dec.txt found in folder {folder}. Skipping.")
+        return "skip"
+    with open(dec_file, "r", encoding='utf-8') as f:
+        input_text = f.read().strip()
+    if not input_text:
+        logging.warning(f"No text in dec.txt for folder {folder}. Skipping.")
+        return "skip"
+
+    if not text_to_speech_with_gtts(input_text, folder, deadline=deadline_after(job_timeout)):
+        logging.error(f"Failed to generate audio for folder: {folder}")
+        return "failed"
+    return "ok", time.monotonic() - started
+
+def encode_folder(folder, budget, **options):
+    # The deadline starts when the encode does, so time spent waiting for a free encoder isn't charged
+    # to the job; budget is what the TTS stage left of the job timeout
+    return generate_reel(folder, deadline=deadline_after(budget), **options)
+
+def record_failure(folder, stage):
+    attempts = job_store.mark_failed(folder, stage, MAX_ATTEMPTS)
+    metrics.inc("reel_jobs_total", status="failed")
+    if attempts >= MAX_ATTEMPTS:
+        logging.warning(f"Giving up on folder {folder}: Max attempts ({MAX_ATTEMPTS}) reached")
+
+def run_worker(workers=1, tts_workers=None, cpu_budget=None, job_timeout=DEFAULT_JOB_TIMEOUT, profile=None, renditions=False,
+               hls=None):
+    # TTS runs on its own thread pool so network waits overlap with CPU-bound encodes,
+    # and each of the `workers` concurrent ffmpeg processes gets an equal share of cpu_budget.
+    tts_workers = tts_workers or workers * 2
+    threads = thread_budget(cpu_budget, workers)
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    # Picked up by the web app's /metrics endpoint
+    metrics_source = f"worker-{worker_id}"
+    logging.info(f"Worker {worker_id}: {workers} encoders x {threads} threads, {tts_workers} TTS threads")
+
+    stop = threading.Event()
+
+    def handle_signal(signum, frame):
+        logging.warning(f"Received signal {signum}, cancelling running jobs")
+        stop.set()
+        terminate_all()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    tts_pool = ThreadPoolExecutor(max_workers=tts_workers, thread_name_prefix="tts")
+    encode_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="encode")
+    tts_futures = {}
+    encode_futures = {}
+    last_sync = 0
+    last_renew = time.time()
+
+    job_store.import_legacy_files(DONE_FILE, FAILED_ATTEMPTS_FILE, MAX_ATTEMPTS)
+    storage.start_sweeper()
+    while not stop.is_set():
+        now = time.time()
+        metrics.set_gauge("reel_worker_inflight", len(tts_futures), stage="tts")
+        metrics.set_gauge("reel_worker_inflight", len(encode_futures), stage="encode")
+        metrics.write_snapshot(metrics_source)
+        if now - last_sync >= POLL_INTERVAL:
+            found = job_store.sync_upload_dir("user_upload")
+            last_sync = now
+            if found:
+                logging.info(f"Registered {found} new folders")
+        if now - last_renew >= LEASE_SECONDS / 3:
+            for folder in list(tts_futures.values()) + list(encode_futures.values()):
+                job_store.renew_lease(folder, worker_id, LEASE_SECONDS)
+            last_renew = now
+
+        # Keep the TTS pool busy and a small backlog of audio-ready folders waiting for an encoder
+        while len(tts_futures) < tts_workers and len(encode_futures) < workers * 2:
+            folder = job_store.claim_next(worker_id, LEASE_SECONDS, max_attempts=MAX_ATTEMPTS)
+            if folder is None:
+                break
+            tts_futures[tts_pool.submit(prepare_audio, folder, job_timeout)] = folder
+
+        pending = list(tts_futures) + list(encode_futures)
+        if not pending:
+            stop.wait(POLL_INTERVAL)
+            continue
+        done, _ = wait(pending, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception():
+                logging.error(f"Stage crashed: {future.exception()}")
+            if future in tts_futures:
+                folder = tts_futures.pop(future)
+                result = "failed" if future.exception() else future.result()
+                if isinstance(result, tuple):
+                    budget = job_timeout - result[1] if job_timeout else None
+                    encode_futures[encode_pool.submit(
+                        encode_folder, folder, budget, threads=threads, profile=profile,
+                        renditions=renditions, hls=hls)] = folder
+                elif result == "skip":
+                    job_store.release(folder, worker_id)
+                else:
+                    record_failure(folder, "tts")
+            else:
+                folder = encode_futures.pop(future)
+                if not future.exception() and future.result():
+                    job_store.mark_done(folder)
+                    metrics.inc("reel_jobs_total", status="done")
                     logging.info(f"Completed processing folder: {folder}")
-                    if folder in failed_attempts:
-                        del failed_attempts[folder]
-                        save_failed_attempt(folder, 0)
+                elif stop.is_set():
+                    job_store.release(folder, worker_id, delay=0)
                 else:
                     logging.error(f"Failed to generate reel for folder: {folder}")
-                    failed_attempts[folder] = failed_attempts.get(folder, 0) + 1
-                    save_failed_attempt(folder, failed_attempts[folder])
-            else:
-                logging.error(f"Failed to generate audio for folder: {folder}")
-                failed_attempts[folder] = failed_attempts.get(folder, 0) + 1
-                save_failed_attempt(folder, failed_attempts[folder])
-        time.sleep(5)  # Increased delay to prevent overloading
\ No newline at end of file
+                    record_failure(folder, "encode")
+
+    # Shutting down: drop queued work and hand unfinished folders back to the store
+    tts_pool.shutdown(wait=False, cancel_futures=True)
+    encode_pool.shutdown(wait=False, cancel_futures=True)
+    terminate_all()
+    for folder in list(tts_futures.values()) + list(encode_futures.values()):
+        job_store.release(folder, worker_id, delay=0)
+    metrics.remove_snapshot(metrics_source)
+    logging.info("Worker stopped")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render reels for folders in user_upload/")
+    parser.add_argument("--workers", type=int, default=1, help="Concurrent ffmpeg encodes")
+    parser.add_argument("--tts-workers", type=int, default=None, help="Concurrent TTS requests (default: 2 x workers)")
+    parser.add_argument("--cpu-budget", type=int, default=None, help="Total cores shared by all encodes (default: all)")
+    parser.add_argument("--timeout", type=int, default=DEFAULT_JOB_TIMEOUT, help="Per-job timeout in seconds, TTS and encode together")
+    parser.add_argument("--profile", choices=sorted(encoder_profiles.ENCODER_PROFILES), default=None,
+                        help=f"Encoder profile (default: {encoder_profiles.DEFAULT_PROFILE})")
+    parser.add_argument("--renditions", action="store_true", help="Also render the smaller 720p/480p renditions")
+    parser.add_argument("--hls", action="store_true", default=None,
+                        help="Also package each reel as segmented HLS (default: REEL_HLS)")
+    args = parser.parse_args()
+    run_worker(args.workers, args.tts_workers, args.cpu_budget, args.timeout, args.profile, args.renditions, args.hls)
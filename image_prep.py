@@ -0,0 +1,92 @@
+import os
+import uuid
+import hashlib
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as PoolTimeout
+
+# Pre-normalizes uploads once (EXIF orientation, resize, letterbox to the reel canvas) so the
+# ffmpeg graph no longer scales every output frame. Results are cached by content hash, so an
+# image reused across reels is only processed the first time.
+IMAGE_CACHE_DIR = os.environ.get("IMAGE_CACHE_DIR", os.path.join("cache", "images"))
+IMAGE_PREP_WORKERS = int(os.environ.get("IMAGE_PREP_WORKERS", str(min(4, os.cpu_count() or 1))))
+TARGET_SIZE = (1080, 1920)
+THUMBNAIL_SIZE = (320, 180)
+JPEG_QUALITY = 92
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cached_image_path(digest, size=TARGET_SIZE):
+    return os.path.join(IMAGE_CACHE_DIR, digest[:2], f"{digest}_{size[0]}x{size[1]}.jpg")
+
+
+def normalize_image(src, size=TARGET_SIZE):
+    # Returns the absolute path of the normalized copy of src, creating it on a cache miss.
+    # Raises if src is not a readable image.
+    size = tuple(size)
+    target = os.path.abspath(cached_image_path(content_hash(src), size))
+    try:
+        # Cache hit; bump mtime so storage eviction treats it as recently used
+        os.utime(target)
+        return target
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    from PIL import Image, ImageOps
+    with Image.open(src) as img:
+        img = ImageOps.exif_transpose(img)
+        img = img.convert("RGB")
+        # Scale to fit and pad with black, matching the old scale/pad filter chain
+        img = ImageOps.pad(img, size, method=Image.LANCZOS, color="black")
+        tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+        img.save(tmp, "JPEG", quality=JPEG_QUALITY)
+    os.replace(tmp, target)
+    return target
+
+
+def make_thumbnail(src, dest, size=THUMBNAIL_SIZE):
+    # Thumbnails come from the normalized first image, so they are identical on every render
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    from PIL import Image
+    with Image.open(src) as img:
+        img.thumbnail(size)
+        tmp = f"{dest}.{uuid.uuid4().hex}.tmp"
+        img.save(tmp, "JPEG", quality=85)
+    os.replace(tmp, dest)
+    return dest
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn keeps worker processes independent of the web app's threads
+            _pool = ProcessPoolExecutor(max_workers=IMAGE_PREP_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def normalize_images(paths, size=TARGET_SIZE, timeout=None):
+    # Normalizes a batch in parallel; small batches run inline to skip the pool round trip.
+    # timeout (seconds for the whole batch) only applies to the pool.
+    size = tuple(size)
+    if len(paths) <= 1 or IMAGE_PREP_WORKERS <= 1:
+        return [normalize_image(path, size) for path in paths]
+    try:
+        results = list(_get_pool().map(normalize_image, paths, [size] * len(paths), timeout=timeout))
+    except PoolTimeout:
+        # A distinct class before Python 3.11
+        raise TimeoutError(f"Normalizing {len(paths)} images took longer than {timeout:.0f}s")
+    logging.info(f"Normalized {len(paths)} images to {size[0]}x{size[1]}")
+    return results
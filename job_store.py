@@ -0,0 +1,244 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+# Embedded job store shared by the web app and any number of generate_process.py workers.
+# SQLite in WAL mode lets readers run alongside the single writer, and every claim runs
+# inside BEGIN IMMEDIATE so two workers can never lease the same folder.
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", "jobs.db")
+DEFAULT_LEASE_SECONDS = 1800
+RETRY_DELAY_SECONDS = 30
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    folder TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    last_error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, lease_expires, updated_at);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_local = threading.local()
+
+
+def get_connection(db_path=None):
+    db_path = db_path or JOB_DB_PATH
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        connections[db_path] = conn
+    return conn
+
+
+@contextmanager
+def immediate(conn):
+    # BEGIN IMMEDIATE takes the write lock up front so the select-then-update in a claim is atomic.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def get_meta(key, default=None, db_path=None):
+    row = get_connection(db_path).execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else default
+
+
+def set_meta(key, value, db_path=None):
+    get_connection(db_path).execute(
+        "INSERT INTO meta (key, value) VALUES (?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (key, str(value)),
+    )
+
+
+def register_folders(folders, db_path=None):
+    now = time.time()
+    conn = get_connection(db_path)
+    with immediate(conn):
+        conn.executemany(
+            "INSERT OR IGNORE INTO jobs (folder, updated_at) VALUES (?, ?)",
+            [(folder, now) for folder in folders],
+        )
+
+
+def sync_upload_dir(upload_dir, db_path=None):
+    # The upload directory's own mtime moves whenever a folder is created, renamed in or removed,
+    # so an unchanged mtime skips the scan. When it has moved, every folder name is checked against
+    # the store: a folder moved in from elsewhere keeps its old mtime and must still be registered.
+    scan_started = time.time()
+    try:
+        dir_mtime = os.stat(upload_dir).st_mtime
+    except FileNotFoundError:
+        logging.warning(f"Upload directory {upload_dir} does not exist")
+        return 0
+    last_mtime = float(get_meta("upload_dir_mtime", -1, db_path))
+    last_scan = float(get_meta("upload_scan_started", 0, db_path))
+    # Also rescan while the mtime is close to the previous scan, in case a folder was added during
+    # that scan without moving a coarse-grained timestamp
+    if dir_mtime == last_mtime and dir_mtime < last_scan - 1:
+        return 0
+    try:
+        with os.scandir(upload_dir) as entries:
+            names = [entry.name for entry in entries if entry.is_dir()]
+    except FileNotFoundError:
+        logging.warning(f"Upload directory {upload_dir} does not exist")
+        return 0
+    known = {row["folder"] for row in get_connection(db_path).execute("SELECT folder FROM jobs")}
+    new_folders = [name for name in names if name not in known]
+    if new_folders:
+        register_folders(new_folders, db_path)
+    set_meta("upload_dir_mtime", dir_mtime, db_path)
+    set_meta("upload_scan_started", scan_started, db_path)
+    return len(new_folders)
+
+
+def claim_next(owner, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=None, db_path=None):
+    # Returns the next pending folder leased to owner, or None. Running jobs whose lease
+    # expired (e.g. their worker crashed) are handed out again.
+    now = time.time()
+    conn = get_connection(db_path)
+    with immediate(conn):
+        row = conn.execute(
+            "SELECT folder FROM jobs "
+            "WHERE status IN ('pending', 'running') AND (lease_expires IS NULL OR lease_expires <= ?) "
+            "AND (? IS NULL OR attempts < ?) "
+            "ORDER BY updated_at LIMIT 1",
+            (now, max_attempts, max_attempts),
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires = ?, updated_at = ? "
+            "WHERE folder = ?",
+            (owner, now + lease_seconds, now, row["folder"]),
+        )
+    return row["folder"]
+
+
+def claim_folder(folder, owner, lease_seconds=DEFAULT_LEASE_SECONDS, db_path=None):
+    # Leases a specific folder, registering it if needed. Fails if another owner holds a live lease.
+    now = time.time()
+    conn = get_connection(db_path)
+    with immediate(conn):
+        conn.execute("INSERT OR IGNORE INTO jobs (folder, updated_at) VALUES (?, ?)", (folder, now))
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires = ?, updated_at = ? "
+            "WHERE folder = ? AND (status != 'running' OR lease_owner = ? OR lease_expires <= ?)",
+            (owner, now + lease_seconds, now, folder, owner, now),
+        )
+        return cursor.rowcount == 1
+
+
+def renew_lease(folder, owner, lease_seconds=DEFAULT_LEASE_SECONDS, db_path=None):
+    cursor = get_connection(db_path).execute(
+        "UPDATE jobs SET lease_expires = ? WHERE folder = ? AND lease_owner = ? AND status = 'running'",
+        (time.time() + lease_seconds, folder, owner),
+    )
+    return cursor.rowcount == 1
+
+
+def release(folder, owner, delay=RETRY_DELAY_SECONDS, db_path=None):
+    # Gives a folder back without counting an attempt (e.g. its upload is not complete yet).
+    now = time.time()
+    get_connection(db_path).execute(
+        "UPDATE jobs SET status = 'pending', lease_owner = NULL, lease_expires = ?, updated_at = ? "
+        "WHERE folder = ? AND lease_owner = ?",
+        (now + delay, now, folder, owner),
+    )
+
+
+def mark_done(folder, db_path=None):
+    now = time.time()
+    get_connection(db_path).execute(
+        "UPDATE jobs SET status = 'done', lease_owner = NULL, lease_expires = NULL, "
+        "last_error = NULL, updated_at = ? WHERE folder = ?",
+        (now, folder),
+    )
+
+
+def mark_failed(folder, error, max_attempts, delay=RETRY_DELAY_SECONDS, db_path=None):
+    # Counts a failed attempt; the folder is retried after delay until max_attempts is reached.
+    now = time.time()
+    conn = get_connection(db_path)
+    with immediate(conn):
+        conn.execute(
+            "UPDATE jobs SET attempts = attempts + 1, last_error = ?, lease_owner = NULL, "
+            "status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END, "
+            "lease_expires = ?, updated_at = ? WHERE folder = ?",
+            (error, max_attempts, now + delay, now, folder),
+        )
+        row = conn.execute("SELECT attempts FROM jobs WHERE folder = ?", (folder,)).fetchone()
+    return row["attempts"] if row else 0
+
+
+def get_job(folder, db_path=None):
+    row = get_connection(db_path).execute("SELECT * FROM jobs WHERE folder = ?", (folder,)).fetchone()
+    return dict(row) if row else None
+
+
+def count_by_status(db_path=None):
+    rows = get_connection(db_path).execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+    return {row["status"]: row["n"] for row in rows}
+
+
+def import_legacy_files(done_file, failed_file, max_attempts, db_path=None):
+    # One-time import of the old done.txt / failed_attempts.txt bookkeeping.
+    if get_meta("legacy_imported", db_path=db_path):
+        return False
+    now = time.time()
+    done = []
+    try:
+        with open(done_file, "r", encoding='utf-8') as f:
+            done = [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        pass
+    failed = {}
+    try:
+        with open(failed_file, "r", encoding='utf-8') as f:
+            for line in f:
+                if ":" in line:
+                    folder, count = line.strip().rsplit(":", 1)
+                    failed[folder] = int(count)
+    except FileNotFoundError:
+        pass
+
+    conn = get_connection(db_path)
+    with immediate(conn):
+        conn.executemany(
+            "INSERT INTO jobs (folder, status, updated_at) VALUES (?, 'done', ?) "
+            "ON CONFLICT(folder) DO UPDATE SET status = 'done'",
+            [(folder, now) for folder in done],
+        )
+        conn.executemany(
+            "INSERT INTO jobs (folder, status, attempts, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(folder) DO UPDATE SET attempts = excluded.attempts, status = excluded.status "
+            "WHERE jobs.status != 'done'",
+            [(folder, 'failed' if count >= max_attempts else 'pending', count, now)
+             for folder, count in failed.items() if folder not in done],
+        )
+        conn.execute("INSERT INTO meta (key, value) VALUES ('legacy_imported', ?)", (str(now),))
+    logging.info(f"Imported {len(done)} done and {len(failed)} failed folders into the job store")
+    return True
@@ -0,0 +1,116 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Bounded local worker pool for reel jobs submitted by the web app.
+# Each job is identified by its reel id (the upload folder name).
+MAX_WORKERS = int(os.environ.get("REEL_WORKERS", "2"))
+MAX_PENDING_JOBS = int(os.environ.get("REEL_MAX_PENDING", "20"))
+FINISHED_JOB_TTL = 3600  # Seconds to keep finished jobs around for status polling
+
+JOB_STATES = ("queued", "running", "done", "failed")
+
+_jobs = {}
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="reel-job")
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobAlreadyExists(Exception):
+    pass
+
+
+def _active_count():
+    return sum(1 for job in _jobs.values() if job["status"] in ("queued", "running"))
+
+
+def _prune_finished(now):
+    expired = [
+        job_id for job_id, job in _jobs.items()
+        if job["status"] in ("done", "failed") and now - job["updated_at"] > FINISHED_JOB_TTL
+    ]
+    for job_id in expired:
+        del _jobs[job_id]
+
+
+def submit_job(job_id, pipeline, *args):
+    # pipeline(job_id, *args) runs in a worker thread and reports progress via update_job().
+    # It returns True on success; a False return or an exception marks the job failed.
+    now = time.time()
+    with _lock:
+        _prune_finished(now)
+        existing = _jobs.get(job_id)
+        if existing and existing["status"] in ("queued", "running"):
+            raise JobAlreadyExists(job_id)
+        if _active_count() >= MAX_PENDING_JOBS:
+            raise JobQueueFull(f"{MAX_PENDING_JOBS} jobs already pending")
+        _jobs[job_id] = {
+            "id": job_id,
+            "status": "queued",
+            "stage": "queued",
+            "progress": 0,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+    _executor.submit(_run_job, job_id, pipeline, args)
+    logging.info(f"Queued job {job_id}")
+    return job_id
+
+
+def update_job(job_id, **fields):
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        job.update(fields)
+        job["updated_at"] = time.time()
+
+
+def is_active(job_id):
+    with _lock:
+        job = _jobs.get(job_id)
+        return bool(job) and job["status"] in ("queued", "running")
+
+
+def queue_depth():
+    # (queued, running) jobs in this process
+    with _lock:
+        queued = sum(1 for job in _jobs.values() if job["status"] == "queued")
+        running = sum(1 for job in _jobs.values() if job["status"] == "running")
+    return queued, running
+
+
+def active_ids():
+    # Ids of the queued and running jobs in this process
+    with _lock:
+        return [job_id for job_id, job in _jobs.items() if job["status"] in ("queued", "running")]
+
+
+def get_job(job_id):
+    with _lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
+
+
+def _run_job(job_id, pipeline, args):
+    update_job(job_id, status="running", stage="starting")
+    logging.info(f"Started job {job_id}")
+    try:
+        ok = pipeline(job_id, *args)
+    except Exception as e:
+        logging.exception(f"Job {job_id} crashed: {e}")
+        update_job(job_id, status="failed", error=str(e))
+        return
+    if ok:
+        update_job(job_id, status="done", stage="done", progress=100)
+        logging.info(f"Job {job_id} finished successfully")
+    else:
+        job = get_job(job_id) or {}
+        update_job(job_id, status="failed", error=job.get("error") or f"Stage {job.get('stage')} failed")
+        logging.error(f"Job {job_id} failed at stage {job.get('stage')}")
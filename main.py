@@ -1,167 +1,172 @@
 import os
+import time
 import uuid
-import subprocess
-from flask import Flask, render_template, request
+import threading
+import mimetypes
+from flask import Flask, render_template, request, jsonify, make_response, Response, send_from_directory
 from werkzeug.utils import secure_filename
 import logging
-from PIL import Image
-from gtts import gTTS
-from pydub import AudioSegment
-
-# Setup logging to file and console
+from text_to_audio import text_to_speech_with_gtts
+from reel import generate_reel
+import jobs
+import job_store
+import gallery_index
+import blob_store
+import encoder_profiles
+import tts_cache
+import metrics
+import ffmpeg_caps
+import storage
+from ffmpeg_utils import deadline_after
+
+# Setup logging to console and, unless LOG_FILE is empty, to a file
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.environ.get("LOG_FILE", "app.log")
 logging.basicConfig(
-    level=logging.DEBUG,  # Changed to DEBUG for more detailed logs
+    level=LOG_LEVEL,
     format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('app.log'),
-        logging.StreamHandler()
-    ]
+    handlers=[logging.StreamHandler()] + ([logging.FileHandler(LOG_FILE)] if LOG_FILE else [])
 )
 
-# Check FFmpeg availability
-def check_ffmpeg():
-    try:
-        result = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True, check=True)
-        logging.info(f"FFmpeg version: {result.stdout.splitlines()[0]}")
-        return True
-    except (subprocess.CalledProcessError, FileNotFoundError) as e:
-        logging.error(f"FFmpeg not found or failed: {e}")
-        return False
-
-if not check_ffmpeg():
+# Check FFmpeg availability; the capability record is cached on disk, so this only spawns
+# ffmpeg the first time a given binary is seen
+ffmpeg_info = ffmpeg_caps.get_capabilities()
+if ffmpeg_info is None:
     logging.error("FFmpeg is required but not found. Please install FFmpeg and ensure it's in PATH.")
     exit(1)
+logging.info(f"FFmpeg version: {ffmpeg_info['version']}")
 
 # Flask app setup
 UPLOAD_FOLDER = 'user_upload'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+WEB_WORKER_ID = f"web-{os.getpid()}"
+LEASE_RENEW_INTERVAL = job_store.DEFAULT_LEASE_SECONDS / 3
+_last_lease_renewal = 0.0
+_lease_lock = threading.Lock()
 
 # Ensure upload and static folders exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(os.path.join('static', 'reels', 'thumbnails'), exist_ok=True)
 os.makedirs(os.path.join('static', 'images'), exist_ok=True)
 
-def text_to_speech_with_gtts(input_text, folder, lang='en', tld='us'):
-    if not isinstance(input_text, str) or not input_text.strip():
-        logging.error("Invalid input: Text must be a non-empty string")
-        return None
-
-    target_dir = os.path.join("user_upload", folder)
-    os.makedirs(target_dir, exist_ok=True)
-    output_filepath = os.path.join(target_dir, "audio.mp3")
-
-    logging.info(f"Generating audio for text: {input_text[:50]}... in folder {folder}")
+GALLERY_PER_PAGE = 24
+MAX_PER_PAGE = 100
+# Whole-job limit for TTS plus encode, so a hung request or encoder can't hold a pool thread for good
+REEL_JOB_TIMEOUT = int(os.environ.get("REEL_JOB_TIMEOUT", "900"))
+REEL_MAX_AGE = int(os.environ.get("REEL_MAX_AGE", "300"))  # Seconds browsers may reuse a reel without revalidating
 
-    try:
-        tts = gTTS(text=input_text, lang=lang, tld=tld, slow=False)
-        tts.save(output_filepath)
-        if os.path.exists(output_filepath) and os.path.getsize(output_filepath) > 0:
-            try:
-                AudioSegment.from_mp3(output_filepath)
-                logging.info(f"Audio file {output_filepath} generated and validated successfully")
-                return output_filepath
-            except Exception as e:
-                logging.error(f"Invalid MP3 file generated at {output_filepath}: {e}")
-                if os.path.exists(output_filepath):
-                    os.remove(output_filepath)
-                return None
-        else:
-            logging.error(f"Audio file {output_filepath} is empty or does not exist")
-            if os.path.exists(output_filepath):
-                os.remove(output_filepath)
-            return None
-    except Exception as e:
-        logging.error(f"gTTS error: {e}, text: {input_text}, folder: {folder}")
-        if os.path.exists(output_filepath):
-            os.remove(output_filepath)
-        return None
+# HLS playlists and fMP4 segments aren't in every platform's mimetypes table
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("video/iso.segment", ".m4s")
+mimetypes.add_type("video/mp4", ".mp4")
 
-def generate_reel(folder):
-    audio_file = os.path.join("user_upload", folder, "audio.mp3")
-    output_file = os.path.join("static", "reels", f"{folder}.mp4")
-    thumbnail_file = os.path.join("static", "reels", "thumbnails", f"{folder}.jpg")  # Fixed syntax error
-    input_file = os.path.join("user_upload", folder, "input.txt")
+# Ensure fallback image exists
+def ensure_fallback_thumbnail():
+    fallback_path = os.path.join("static", gallery_index.FALLBACK_THUMBNAIL)
+    if not os.path.exists(fallback_path):
+        from PIL import Image, ImageDraw
+        img = Image.new("RGB", (200, 200), color="grey")
+        d = ImageDraw.Draw(img)
+        d.text((10, 90), "No Thumbnail", fill="white")
+        img.save(fallback_path, "JPEG")
+        logging.info(f"Created default fallback thumbnail at {fallback_path}")
 
-    # Verify required files
-    if not os.path.exists(audio_file):
-        logging.error(f"Audio file {audio_file} does not exist")
+ensure_fallback_thumbnail()
+
+_background_started = False
+_background_lock = threading.Lock()
+
+def start_background_tasks():
+    # One-off startup work for the serving process: the gallery backfill and the storage sweeper.
+    # Runs before the first request under any server (python main.py, flask run, WSGI), never at
+    # import, so image_prep's spawned pool workers (which re-import the launching script) skip it.
+    global _background_started
+    with _background_lock:
+        if _background_started:
+            return
+        _background_started = True
+    gallery_index.backfill_from_disk()
+    storage.start_sweeper()
+
+@app.before_request
+def ensure_background_tasks():
+    if not _background_started:
+        start_background_tasks()
+
+def renew_web_leases():
+    # Keeps the job store leases of this process's queued and running jobs alive, so no
+    # generate_process.py worker takes over a folder the web app is still going to render.
+    # Called on every stage and progress report, at most once per LEASE_RENEW_INTERVAL; queued
+    # jobs stay leased because the jobs ahead of them keep reporting.
+    global _last_lease_renewal
+    with _lease_lock:
+        now = time.time()
+        if now - _last_lease_renewal < LEASE_RENEW_INTERVAL:
+            return
+        _last_lease_renewal = now
+    for job_id in jobs.active_ids():
+        job_store.renew_lease(job_id, WEB_WORKER_ID)
+
+def process_reel(job_id, desc, input_files, profile=None, renditions=False):
+    # Keep the shared job store in sync so generate_process.py workers skip this folder
+    if not job_store.renew_lease(job_id, WEB_WORKER_ID):
+        # The lease ran out while queued and a worker took the folder over; it owns the job now
+        logging.warning(f"Lease on {job_id} was lost while queued, leaving it to the worker holding it")
+        jobs.update_job(job_id, error="This reel is being generated by a background worker.")
         return False
-    if not os.path.exists(input_file):
-        logging.error(f"Input file {input_file} does not exist")
-        return False
-
-    # Verify audio file
     try:
-        AudioSegment.from_mp3(audio_file)
-        logging.info(f"Validated audio file: {audio_file}")
+        ok = run_reel_pipeline(job_id, desc, input_files, profile, renditions)
     except Exception as e:
-        logging.error(f"Invalid audio file {audio_file}: {e}")
+        # Failures are terminal, so the store agrees with what /jobs/<id> reports
+        job_store.mark_failed(job_id, str(e), 1)
+        metrics.inc("reel_jobs_total", status="failed")
+        raise
+    metrics.inc("reel_jobs_total", status="done" if ok else "failed")
+    if ok:
+        job_store.mark_done(job_id)
+    else:
+        job = jobs.get_job(job_id) or {}
+        job_store.mark_failed(job_id, job.get("error"), 1)
+    return ok
+
+def run_reel_pipeline(job_id, desc, input_files, profile=None, renditions=False):
+    folder_path = os.path.join(app.config['UPLOAD_FOLDER'], job_id)
+    deadline = deadline_after(REEL_JOB_TIMEOUT)
+
+    # Generate audio
+    jobs.update_job(job_id, stage="tts", progress=10)
+    audio_filepath = text_to_speech_with_gtts(desc, job_id, lang='en', tld='us', deadline=deadline)
+    if not audio_filepath:
+        jobs.update_job(job_id, error="Failed to generate audio for the reel. Check network or logs.")
         return False
 
-    # Verify input.txt content and image files
-    try:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            input_content = f.read()
-        if not input_content.strip():
-            logging.error(f"Input file {input_file} is empty")
-            return False
-        logging.info(f"Input file content: {input_content}")
-        for line in input_content.split('\n'):
-            if line.startswith("file '"):
-                image_file = line.split("'")[1]
-                image_path = os.path.join("user_upload", folder, image_file)
-                if not os.path.exists(image_path):
-                    logging.error(f"Image file {image_path} does not exist")
-                    return False
-                try:
-                    Image.open(image_path).verify()
-                    logging.info(f"Validated image file: {image_path}")
-                except Exception as e:
-                    logging.error(f"Invalid image file {image_path}: {e}")
-                    return False
-    except Exception as e:
-        logging.error(f"Error reading input file {input_file}: {e}")
-        return False
+    # Generate reel
+    jobs.update_job(job_id, stage="encode", progress=30)
+    renew_web_leases()
 
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
-    os.makedirs(os.path.dirname(thumbnail_file), exist_ok=True)
+    def on_progress(report):
+        # The encode covers 30-95% of the job's progress bar
+        fields = {"fps": report["fps"], "speed": report["speed"]}
+        if "percent" in report:
+            fields["progress"] = 30 + int(report["percent"] * 0.65)
+        jobs.update_job(job_id, **fields)
+        renew_web_leases()
 
-    # Simplified FFmpeg command
-    command = (
-        f'ffmpeg -f concat -safe 0 -i "{input_file}" -i "{audio_file}" '
-        f'-vf "scale=1080:1920:force_original_aspect_ratio=decrease,pad=1080:1920:(ow-iw)/2:(oh-ih)/2:black,fps=30" '
-        f'-c:v libx264 -c:a aac -shortest -pix_fmt yuv420p "{output_file}"'
-    )
-    logging.info(f"Running FFmpeg command: {command}")
-    try:
-        result = subprocess.run(command, shell=True, capture_output=True, text=True, check=True)
-        logging.info(f"Reel generated successfully: {output_file}")
-        logging.debug(f"FFmpeg output: {result.stdout}")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"FFmpeg error (reel generation): {e.stderr}")
+    if not generate_reel(job_id, profile=profile, renditions=renditions, on_progress=on_progress, deadline=deadline):
+        jobs.update_job(job_id, error="Failed to generate reel video. Check FFmpeg installation or logs.")
         return False
 
-    # Verify reel file exists
+    # Verify reel exists
+    output_file = os.path.join("static", "reels", f"{job_id}.mp4")
     if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
-        logging.error(f"Reel file {output_file} was not created or is empty")
+        logging.error(f"Reel file {output_file} not found or is empty after generation.")
+        jobs.update_job(job_id, error="Reel file was not created. Check logs for details.")
         return False
 
-    # Generate thumbnail
-    thumbnail_command = (
-        f'ffmpeg -i "{output_file}" -vframes 1 -vf "scale=320:180:force_original_aspect_ratio=decrease" '
-        f'"{thumbnail_file}"'
-    )
-    logging.info(f"Running FFmpeg thumbnail command: {thumbnail_command}")
-    try:
-        result = subprocess.run(thumbnail_command, shell=True, capture_output=True, text=True, check=True)
-        logging.info(f"Thumbnail generated successfully: {thumbnail_file}")
-        logging.debug(f"FFmpeg thumbnail output: {result.stdout}")
-        return True
-    except subprocess.CalledProcessError as e:
-        logging.error(f"FFmpeg error (thumbnail generation): {e.stderr}")
-        return False
+    logging.info(f"Created reel {job_id} successfully")
+    return True
 
 @app.route("/")
 def home():
@@ -174,45 +179,64 @@ def create():
     if request.method == "POST":
         rec_id = request.form.get("uuid") or myid
         desc = request.form.get("text")
+        profile = request.form.get("profile") or encoder_profiles.DEFAULT_PROFILE
+        renditions = request.form.get("renditions") == "on"
         input_files = []
 
+        if profile not in encoder_profiles.ENCODER_PROFILES:
+            return render_template("create.html", id=myid, error=f"Unknown encoding profile {profile}."), 400
+
+        if jobs.is_active(rec_id):
+            logging.warning(f"Job {rec_id} is already queued or running")
+            return render_template("create.html", id=myid, error="This reel is already being generated."), 409
+
+        if not job_store.claim_folder(rec_id, WEB_WORKER_ID):
+            logging.warning(f"Folder {rec_id} is leased by another worker")
+            return render_template("create.html", id=myid, error="This reel is already being generated."), 409
+
+        def reject(error, status=200):
+            # Ends the web lease for good, so no worker keeps picking up a half-written upload
+            job_store.mark_failed(rec_id, error, 1)
+            return render_template("create.html", id=myid, error=error), status
+
         folder_path = os.path.join(app.config['UPLOAD_FOLDER'], rec_id)
         os.makedirs(folder_path, exist_ok=True)
 
         # Handle dynamic file inputs (file1, file2, etc.)
-        for key in request.files:
-            if key.startswith('file') and request.files[key].filename:
-                file = request.files[key]
-                filename = secure_filename(file.filename)
-                if filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS:
-                    file_path = os.path.join(folder_path, filename)
-                    try:
-                        file.save(file_path)
-                        if os.path.exists(file_path):
-                            try:
-                                Image.open(file_path).verify()
-                                input_files.append(filename)
-                                logging.info(f"Saved and validated file: {file_path}")
-                            except Exception as e:
-                                logging.error(f"Invalid image file {file_path}: {e}")
-                                os.remove(file_path)
-                                return render_template("create.html", id=myid, error=f"Invalid image file {filename}: {e}")
-                        else:
-                            logging.error(f"File {file_path} was not saved")
-                            return render_template("create.html", id=myid, error=f"Failed to save file {filename}.")
-                    except Exception as e:
-                        logging.error(f"Failed to save file {filename}: {e}")
-                        return render_template("create.html", id=myid, error=f"Failed to save file {filename}: {e}")
-                else:
-                    logging.warning(f"File {filename} not allowed. Skipping.")
+        with metrics.span("upload", reel=rec_id) as span:
+            for key in request.files:
+                if key.startswith('file') and request.files[key].filename:
+                    file = request.files[key]
+                    filename = secure_filename(file.filename)
+                    extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+                    if extension in ALLOWED_EXTENSIONS:
+                        file_path = os.path.join(folder_path, filename)
+                        # Stream into the content-addressed blob store and link it into the reel folder
+                        try:
+                            blob, is_new = blob_store.ingest_upload(file.stream, extension)
+                            blob_store.link_or_copy(blob, file_path)
+                            input_files.append(filename)
+                            metrics.inc("upload_files_total", result="new" if is_new else "dedup")
+                            logging.info(f"Saved {'new' if is_new else 'deduplicated'} file: {file_path}")
+                        except blob_store.InvalidUpload as e:
+                            logging.error(f"Invalid image file {filename}: {e}")
+                            metrics.inc("upload_files_total", result="invalid")
+                            span.fail()
+                            return reject(f"Invalid image file {filename}: {e}")
+                        except Exception as e:
+                            logging.error(f"Failed to save file {filename}: {e}")
+                            span.fail()
+                            return reject(f"Failed to save file {filename}: {e}")
+                    else:
+                        logging.warning(f"File {filename} not allowed. Skipping.")
 
         if not input_files:
             logging.error("No valid image files uploaded.")
-            return render_template("create.html", id=myid, error="Please upload at least one valid image file (PNG, JPG, JPEG).")
+            return reject("Please upload at least one valid image file (PNG, JPG, JPEG).")
 
         if not desc or not desc.strip():
             logging.error("No description provided.")
-            return render_template("create.html", id=myid, error="Please provide a description for the reel.")
+            return reject("Please provide a description for the reel.")
 
         # Save the description
         desc_file = os.path.join(folder_path, "dec.txt")
@@ -222,97 +246,137 @@ def create():
             logging.info(f"Saved description to {desc_file}")
         except Exception as e:
             logging.error(f"Failed to save description to {desc_file}: {e}")
-            return render_template("create.html", id=myid, error=f"Failed to save description: {e}")
+            return reject(f"Failed to save description: {e}")
 
-        # Write input.txt with relative filenames
+        # Write input.txt with relative filenames; durations are planned from the narration at encode time
         input_file = os.path.join(folder_path, "input.txt")
         try:
             with open(input_file, "w", encoding='utf-8') as f:
                 for fl in input_files:
                     f.write(f"file '{fl}'\n")
-                    f.write("duration 2\n")  # Increased duration for better visibility
             logging.info(f"Created input.txt with {len(input_files)} images")
         except Exception as e:
             logging.error(f"Failed to create input.txt: {e}")
-            return render_template("create.html", id=myid, error=f"Failed to create input file: {e}")
-
-        # Generate audio
-        audio_filepath = text_to_speech_with_gtts(desc, rec_id, lang='en', tld='us')
-        if not audio_filepath:
-            logging.error("Failed to generate audio.")
-            return render_template("create.html", id=myid, error="Failed to generate audio for the reel. Check network or logs.")
+            return reject(f"Failed to create input file: {e}")
 
-        # Generate thumbnail from the first image
-        thumbnail_path = os.path.join('static', 'reels', 'thumbnails', f"{rec_id}.jpg")
+        # Hand the slow TTS/encode pipeline off to the worker pool
         try:
-            with Image.open(os.path.join(folder_path, input_files[0])) as img:
-                img.thumbnail((200, 200))
-                os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
-                img.save(thumbnail_path, "JPEG")
-            logging.info(f"Generated thumbnail at {thumbnail_path}")
-        except Exception as e:
-            logging.error(f"Failed to generate thumbnail for {rec_id}: {e}")
-            return render_template("create.html", id=myid, error=f"Failed to generate thumbnail: {e}")
+            jobs.submit_job(rec_id, process_reel, desc, input_files, profile, renditions)
+        except jobs.JobAlreadyExists:
+            logging.warning(f"Job {rec_id} is already queued or running")
+            return render_template("create.html", id=myid, error="This reel is already being generated."), 409
+        except jobs.JobQueueFull as e:
+            logging.error(f"Rejected job {rec_id}: {e}")
+            return reject("The server is busy. Please try again in a minute.", 503)
+
+        logging.info(f"Accepted reel {rec_id} for generation")
+        return render_template("create.html", id=myid, job_id=rec_id), 202
+
+    return render_template("create.html", id=myid, profiles=encoder_profiles.ENCODER_PROFILES,
+                           default_profile=encoder_profiles.DEFAULT_PROFILE)
+
+# Job store statuses as the in-process job API reports them
+STORE_STATUS = {"pending": "queued", "running": "running", "done": "done", "failed": "failed"}
+
+def _job_from_store(job_id):
+    # Status of a job owned by another web process or a generate_process.py worker; only the
+    # coarse status is shared, so stage and progress are approximate
+    record = job_store.get_job(job_id)
+    if record is None:
+        return None
+    status = STORE_STATUS.get(record["status"], record["status"])
+    return {
+        "id": job_id,
+        "status": status,
+        "stage": status,
+        "progress": 100 if status == "done" else 0,
+        "error": record["last_error"] if status == "failed" else None,
+        "updated_at": record["updated_at"],
+    }
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = jobs.get_job(job_id)
+    if job is None or job["status"] == "failed":
+        # Web failures are terminal in the store, so a store record that isn't failed means another
+        # worker took the folder over (e.g. after this process lost its lease) and is authoritative
+        stored = _job_from_store(job_id)
+        if job is None or (stored and stored["status"] != "failed"):
+            job = stored
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job)
+
+@app.route("/reels/<path:filename>")
+def serve_reel(filename):
+    # Range requests (seeking, progressive playback), ETag and Last-Modified are handled by Werkzeug
+    response = send_from_directory(gallery_index.REELS_DIR, filename, conditional=True, max_age=REEL_MAX_AGE)
+    response.headers["Accept-Ranges"] = "bytes"
+    return response
+
+@app.route("/metrics")
+def metrics_endpoint():
+    # Prometheus scrape target: this process, live worker snapshots and a few point-in-time gauges
+    queued, running = jobs.queue_depth()
+    extra = [
+        ("reel_queue_depth", {"state": "queued"}, queued),
+        ("reel_queue_depth", {"state": "running"}, running),
+    ]
+    extra += [("reel_jobs", {"status": status}, count) for status, count in job_store.count_by_status().items()]
+    extra.append(("tts_cache_hit_ratio", {}, round(tts_cache.get_stats()["hit_rate"], 4)))
+    return Response(metrics.render_prometheus(extra), mimetype="text/plain; version=0.0.4")
+
+def _conditional_response(etag, last_modified, render):
+    # Answer 304 when the client's copy is current; otherwise render and tag the response
+    if request.if_none_match.contains(etag) or (
+        not request.if_none_match and request.if_modified_since
+        and int(last_modified) <= request.if_modified_since.timestamp()
+    ):
+        response = make_response("", 304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+def _gallery_page_args():
+    page = max(1, request.args.get("page", 1, type=int))
+    per_page = min(MAX_PER_PAGE, max(1, request.args.get("per_page", GALLERY_PER_PAGE, type=int)))
+    return page, per_page
 
-        # Generate reel
-        if not generate_reel(rec_id):
-            logging.error("Failed to generate reel.")
-            return render_template("create.html", id=myid, error="Failed to generate reel video. Check FFmpeg installation or logs.")
+@app.route("/gallery")
+def gallery():
+    page, per_page = _gallery_page_args()
+    count, last_modified = gallery_index.get_version()
+    etag = f"gallery-{count}-{last_modified:.6f}-{page}-{per_page}"
+    pages = max(1, -(-count // per_page))
 
-        # Verify reel exists
-        output_file = os.path.join("static", "reels", f"{rec_id}.mp4")
-        if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
-            logging.error(f"Reel file {output_file} not found or is empty after generation.")
-            return render_template("create.html", id=myid, error="Reel file was not created. Check logs for details.")
+    def render():
+        reels = gallery_index.list_reels(page, per_page)
+        logging.info(f"Rendering gallery page {page}/{pages} with {len(reels)} of {count} reels")
+        return render_template("gallery.html", reels=reels, page=page, pages=pages)
 
-        logging.info(f"Created reel {rec_id} successfully")
-        return render_template("create.html", id=myid, success=True)
+    return _conditional_response(etag, last_modified, render)
 
-    return render_template("create.html", id=myid)
+@app.route("/api/reels")
+def api_reels():
+    page, per_page = _gallery_page_args()
+    count, last_modified = gallery_index.get_version()
+    etag = f"reels-{count}-{last_modified:.6f}-{page}-{per_page}-{request.args.get('width', '')}"
 
-@app.route("/gallery")
-def gallery():
-    reels_dir = os.path.join("static", "reels")
-    os.makedirs(reels_dir, exist_ok=True)
-    reels = []
-    fallback_thumbnail = os.path.join("images", "fallback.jpg").replace(os.sep, "/")
+    # ?width= asks for the smallest rendition at least that many pixels wide
+    width = request.args.get("width", type=int)
 
-    # Ensure fallback image exists
-    fallback_path = os.path.join("static", fallback_thumbnail)
-    if not os.path.exists(fallback_path):
-        from PIL import Image, ImageDraw
-        os.makedirs(os.path.dirname(fallback_path), exist_ok=True)
-        img = Image.new("RGB", (200, 200), color="grey")
-        d = ImageDraw.Draw(img)
-        d.text((10, 90), "No Thumbnail", fill="white")
-        img.save(fallback_path, "JPEG")
-        logging.info(f"Created default fallback thumbnail at {fallback_path}")
+    def render():
+        reels = gallery_index.list_reels(page, per_page)
+        if width:
+            for reel in reels:
+                reel["best"] = gallery_index.pick_rendition(reel["renditions"], width)
+        return jsonify({"page": page, "per_page": per_page, "total": count, "reels": reels})
 
-    for f in os.listdir(reels_dir):
-        if f.endswith(".mp4"):
-            folder_id = f.replace(".mp4", "")
-            dec_file = os.path.join("user_upload", folder_id, "dec.txt")
-            thumbnail = os.path.join("reels", "thumbnails", f"{folder_id}.jpg").replace(os.sep, "/")
-            thumbnail_path = os.path.join("static", thumbnail)
-
-            thumbnail_rel_path = thumbnail if os.path.exists(thumbnail_path) else fallback_thumbnail
-            title = "Untitled"
-            try:
-                if os.path.exists(dec_file):
-                    with open(dec_file, "r", encoding='utf-8') as df:
-                        title = df.read().strip()[:50] or "Untitled"
-            except Exception as e:
-                logging.error(f"Error reading description file {dec_file}: {e}")
-            reels.append({
-                "file": f,
-                "title": title,
-                "thumbnail": thumbnail_rel_path,
-                "creator": "Anonymous"
-            })
-            logging.info(f"Added reel {f} to gallery with thumbnail: /static/{thumbnail_rel_path}")
-    logging.info(f"Files in reels_dir: {os.listdir(reels_dir)}")
-    logging.info(f"Found {len(reels)} reels in {reels_dir}")
-    return render_template("gallery.html", reels=reels, folder="reels")
+    return _conditional_response(etag, last_modified, render)
 
 if __name__ == "__main__":
+    start_background_tasks()
     app.run(debug=True, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,121 @@
+import os
+import re
+import json
+import logging
+import subprocess
+import ffmpeg_caps
+
+# Lightweight media validation: reads container and stream headers via ffprobe instead of
+# decoding the whole file, and caches the result in a sidecar JSON next to the media file.
+SIDECAR_SUFFIX = ".probe.json"
+
+_DURATION_RE = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+_AUDIO_RE = re.compile(r"Stream #\S+.*?: Audio: (\w+)[^,]*, (\d+) Hz, ([^,]+)")
+_VIDEO_RE = re.compile(r"Stream #\S+.*?: Video: (\w+).*?, (\d{2,5})x(\d{2,5})")
+_INPUT_RE = re.compile(r"Input #0, ([^,]+(?:,[^,]+)*?), from")
+
+
+def _file_signature(path):
+    # Identity rather than mtime: audio.mp3 is a hard link to a TTS cache entry whose mtime is bumped
+    # on every cache hit, which would invalidate the sidecar of every folder sharing that inode.
+    # Media files are only ever replaced (os.replace), never rewritten in place, so a new inode
+    # means new content.
+    st = os.stat(path)
+    return {"size": st.st_size, "dev": st.st_dev, "ino": st.st_ino}
+
+
+def _from_ffprobe(path, timeout):
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+        capture_output=True, text=True, timeout=timeout,
+    )
+    if result.returncode != 0:
+        return {"valid": False, "error": result.stderr.strip()}
+    data = json.loads(result.stdout or "{}")
+    fmt = data.get("format", {})
+    info = {"valid": True, "format": fmt.get("format_name"), "duration": None, "streams": []}
+    if fmt.get("duration"):
+        info["duration"] = float(fmt["duration"])
+    for stream in data.get("streams", []):
+        entry = {"type": stream.get("codec_type"), "codec": stream.get("codec_name")}
+        if stream.get("codec_type") == "audio":
+            entry["sample_rate"] = int(stream.get("sample_rate") or 0)
+            entry["channels"] = stream.get("channels")
+        elif stream.get("codec_type") == "video":
+            entry["width"] = stream.get("width")
+            entry["height"] = stream.get("height")
+        info["streams"].append(entry)
+    return info
+
+
+def _from_ffmpeg(path, timeout):
+    # Fallback for installs without ffprobe: `ffmpeg -i` with no output only parses headers
+    result = subprocess.run(["ffmpeg", "-hide_banner", "-i", path], capture_output=True, text=True, timeout=timeout)
+    stderr = result.stderr
+    if "Invalid data found" in stderr or "Input #0" not in stderr:
+        return {"valid": False, "error": stderr.strip().splitlines()[-1] if stderr.strip() else "unreadable"}
+    info = {"valid": True, "format": None, "duration": None, "streams": []}
+    match = _INPUT_RE.search(stderr)
+    if match:
+        info["format"] = match.group(1)
+    match = _DURATION_RE.search(stderr)
+    if match:
+        hours, minutes, seconds = match.groups()
+        info["duration"] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    for codec, rate, layout in _AUDIO_RE.findall(stderr):
+        info["streams"].append({"type": "audio", "codec": codec, "sample_rate": int(rate), "channels": layout.strip()})
+    for codec, width, height in _VIDEO_RE.findall(stderr):
+        info["streams"].append({"type": "video", "codec": codec, "width": int(width), "height": int(height)})
+    return info
+
+
+def probe(path, timeout=30):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return {"valid": False, "error": "missing or empty file"}
+    caps = ffmpeg_caps.get_capabilities()
+    try:
+        # Don't try to spawn ffprobe when the capability record already says it isn't installed
+        info = _from_ffprobe(path, timeout) if caps is None or caps.get("ffprobe") else _from_ffmpeg(path, timeout)
+    except FileNotFoundError:
+        info = _from_ffmpeg(path, timeout)
+    except (subprocess.TimeoutExpired, ValueError) as e:
+        info = {"valid": False, "error": str(e)}
+    audio = [s for s in info.get("streams", []) if s["type"] == "audio"]
+    if audio:
+        info["codec"] = audio[0]["codec"]
+        info["sample_rate"] = audio[0].get("sample_rate")
+    return info
+
+
+def write_sidecar(path, info):
+    sidecar = path + SIDECAR_SUFFIX
+    record = dict(info, signature=_file_signature(path))
+    tmp = sidecar + ".tmp"
+    with open(tmp, "w", encoding='utf-8') as f:
+        json.dump(record, f)
+    os.replace(tmp, sidecar)
+
+
+def probe_cached(path):
+    # Reuse the sidecar while the file is the same inode with the same size, otherwise probe again
+    sidecar = path + SIDECAR_SUFFIX
+    try:
+        with open(sidecar, "r", encoding='utf-8') as f:
+            record = json.load(f)
+        if record.get("signature") == _file_signature(path):
+            return record
+    except (FileNotFoundError, ValueError):
+        pass
+    info = probe(path)
+    if info.get("valid"):
+        try:
+            write_sidecar(path, info)
+        except OSError as e:
+            logging.warning(f"Could not write probe sidecar for {path}: {e}")
+    return info
+
+
+def is_valid_audio(info):
+    return bool(info.get("valid")) and bool(info.get("duration")) and any(
+        s["type"] == "audio" for s in info.get("streams", [])
+    )
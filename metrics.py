@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import glob
+import logging
+import threading
+from contextlib import contextmanager
+
+# In-process metrics with Prometheus text exposition. Worker processes periodically dump a
+# snapshot into METRICS_DIR and the web app's /metrics merges them with its own values.
+METRICS_DIR = os.environ.get("METRICS_DIR", "metrics")
+SNAPSHOT_MAX_AGE = 600  # Ignore snapshots from workers that stopped reporting
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}
+_help = {
+    "reel_stage_duration_seconds": "Time spent in each pipeline stage",
+    "reel_stage_failures_total": "Pipeline stage failures",
+    "reel_jobs_total": "Finished reel jobs by outcome",
+    "reel_encode_fps": "Frames per second of the most recent encode progress report",
+    "reel_encode_speed": "Encode speed relative to realtime from the most recent progress report",
+    "upload_files_total": "Uploaded images by blob store outcome",
+    "reel_worker_inflight": "Folders a worker is currently processing, by stage",
+    "reel_queue_depth": "Web app reel jobs by state",
+    "reel_jobs": "Jobs in the shared job store by status",
+    "render_cache_lookups_total": "Render artifact cache lookups by artifact kind and result",
+    "storage_evictions_total": "Items deleted by the storage sweeper, by category",
+    "storage_freed_bytes_total": "Bytes freed by the storage sweeper, by category",
+    "storage_bytes": "Indexed bytes on disk per storage category after the last sweep",
+    "tts_cache_hit_ratio": "Share of the web app's TTS cache lookups served from the cache",
+    "tts_chunks_total": "TTS chunks synthesized, by outcome (ok, retried, failed)",
+    "tts_cache_lookups_total": "TTS cache lookups by result",
+    "tts_cache_evictions_total": "Entries evicted from the TTS cache",
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = {"buckets": list(buckets), "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(hist["buckets"]):
+            if value <= bound:
+                hist["counts"][i] += 1
+        hist["sum"] += value
+        hist["count"] += 1
+
+
+class Span:
+    def __init__(self):
+        self.ok = True
+
+    def fail(self):
+        self.ok = False
+
+
+@contextmanager
+def span(stage, **fields):
+    # Times a pipeline stage, records it in the stage histogram and emits one structured log line.
+    # Stages that signal failure by return value call span.fail(); exceptions count as failures too.
+    current = Span()
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException:
+        current.ok = False
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        observe("reel_stage_duration_seconds", duration, stage=stage)
+        if not current.ok:
+            inc("reel_stage_failures_total", stage=stage)
+        logging.info(json.dumps({"event": "span", "stage": stage, "duration_s": round(duration, 4),
+                                 "ok": current.ok, **fields}))
+
+
+def snapshot():
+    with _lock:
+        return {
+            "counters": [[name, dict(labels), value] for (name, labels), value in _counters.items()],
+            "gauges": [[name, dict(labels), value] for (name, labels), value in _gauges.items()],
+            "histograms": [[name, dict(labels), dict(hist, counts=list(hist["counts"]))]
+                           for (name, labels), hist in _histograms.items()],
+        }
+
+
+def write_snapshot(source):
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{source}.json")
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding='utf-8') as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp, path)
+    return path
+
+
+def remove_snapshot(source):
+    try:
+        os.remove(os.path.join(METRICS_DIR, f"{source}.json"))
+    except FileNotFoundError:
+        pass
+
+
+def _read_worker_snapshots():
+    now = time.time()
+    for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        try:
+            if now - os.path.getmtime(path) > SNAPSHOT_MAX_AGE:
+                continue
+            with open(path, "r", encoding='utf-8') as f:
+                yield json.load(f)
+        except (OSError, ValueError):
+            continue
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=None):
+    items = dict(labels, **(extra or {}))
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(items.items())) + "}"
+
+
+def render_prometheus(extra_gauges=None):
+    # Local values are labelled source="web", worker snapshots source="worker" (summed across workers)
+    counters, gauges, histograms = {}, {}, {}
+
+    def merge(data, source):
+        for name, labels, value in data["counters"]:
+            key = _key(name, dict(labels, source=source))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in data["gauges"]:
+            key = _key(name, dict(labels, source=source))
+            gauges[key] = gauges.get(key, 0) + value if source == "worker" else value
+        for name, labels, hist in data["histograms"]:
+            key = _key(name, dict(labels, source=source))
+            merged = histograms.get(key)
+            if merged is None:
+                histograms[key] = dict(hist, counts=list(hist["counts"]))
+            elif merged["buckets"] == hist["buckets"]:
+                merged["counts"] = [a + b for a, b in zip(merged["counts"], hist["counts"])]
+                merged["sum"] += hist["sum"]
+                merged["count"] += hist["count"]
+
+    merge(snapshot(), "web")
+    for data in _read_worker_snapshots():
+        merge(data, "worker")
+    for name, labels, value in extra_gauges or []:
+        gauges[_key(name, labels)] = value
+
+    lines = []
+    seen = set()
+
+    def header(name, kind):
+        if name not in seen:
+            seen.add(name)
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, "counter")
+        lines.append(f"{name}{_format_labels(dict(labels))} {value}")
+    for (name, labels), value in sorted(gauges.items()):
+        header(name, "gauge")
+        lines.append(f"{name}{_format_labels(dict(labels))} {value}")
+    for (name, labels), hist in sorted(histograms.items()):
+        header(name, "histogram")
+        labels = dict(labels)
+        for bound, count in zip(hist["buckets"], hist["counts"]):
+            lines.append(f"{name}_bucket{_format_labels(labels, {'le': bound})} {count}")
+        lines.append(f"{name}_bucket{_format_labels(labels, {'le': '+Inf'})} {hist['count']}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {hist['sum']}")
+        lines.append(f"{name}_count{_format_labels(labels)} {hist['count']}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,339 @@
+import os
+import shutil
+import logging
+import media_probe
+import image_prep
+import gallery_index
+import encoder_profiles
+import metrics
+import timeline
+import render_cache
+import blob_store
+import ffmpeg_caps
+from ffmpeg_utils import run_ffmpeg, FFmpegError, cancelled, deadline_after, time_left
+
+# Reel rendering shared by the web app (main.py) and the background worker (generate_process.py)
+ANIMATED_PREVIEW = os.environ.get("REEL_ANIMATED_PREVIEW") == "1"
+PREVIEW_SECONDS = 3
+PREVIEW_WIDTH = 270
+# Segmented HLS (fMP4) copies of every rendition, for players that stream rather than download
+HLS_OUTPUT = os.environ.get("REEL_HLS") == "1"
+HLS_SEGMENT_SECONDS = 4
+HLS_DIR = os.path.join("static", "reels", "hls")
+
+
+def read_concat_list(input_file):
+    # (image filename, duration or None) entries of a concat input.txt, in order. Durations written
+    # by older versions of the app are parsed but no longer used; the timeline planner decides.
+    with open(input_file, 'r', encoding='utf-8') as f:
+        input_content = f.read()
+    entries = []
+    for line in input_content.split('\n'):
+        if line.startswith("file '"):
+            entries.append([line.split("'")[1], None])
+        elif line.startswith("duration ") and entries:
+            entries[-1][1] = float(line.split()[1])
+    return [tuple(entry) for entry in entries]
+
+
+def write_concat_list(path, entries):
+    with open(path, 'w', encoding='utf-8') as f:
+        for image_path, duration in entries:
+            escaped = image_path.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+            if duration is not None:
+                f.write(f"duration {duration}\n")
+
+
+def _read_description(folder):
+    dec_file = os.path.join("user_upload", folder, "dec.txt")
+    try:
+        with open(dec_file, 'r', encoding='utf-8') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def build_encode_args(input_file, outputs, profile, threads=None, preview_file=None, segment_seconds=None):
+    # Video-only encode of the planned timeline. One decode feeds every output: the frame stream is
+    # split once per rendition (plus the optional preview) and each branch is scaled only if it
+    # differs from the normalized canvas. Narration is muxed in afterwards by build_mux_args().
+    canvas = (profile["width"], profile["height"])
+    branches = len(outputs) + (1 if preview_file else 0)
+    graph = [f"[0:v]fps={timeline.FPS},split={branches}" + "".join(f"[s{i}]" for i in range(branches))]
+    for i, (_, width, height, _) in enumerate(outputs):
+        graph.append(f"[s{i}]null[v{i}]" if (width, height) == canvas else f"[s{i}]scale={width}:{height}[v{i}]")
+    if preview_file:
+        graph.append(f"[s{len(outputs)}]trim=duration={PREVIEW_SECONDS},fps=10,scale={PREVIEW_WIDTH}:-2[preview]")
+
+    args = ["-f", "concat", "-safe", "0", "-i", input_file]
+    # -filter_threads only covers simple (-vf) graphs; the split/scale graph needs the complex variant
+    if threads and ffmpeg_caps.has_option("filter_complex_threads"):
+        args += ["-filter_complex_threads", str(threads)]
+    args += ["-filter_complex", ";".join(graph)]
+    # Share the thread budget between the encoders running side by side
+    encoder_threads = max(1, threads // len(outputs)) if outputs and threads else None
+    encoder = ffmpeg_caps.video_encoder()
+    if encoder == "libx264":
+        codec_args = ["-c:v", encoder, "-preset", profile["preset"], "-crf", str(profile["crf"])]
+    else:
+        codec_args = ["-c:v", encoder, "-b:v", profile["video_bitrate"]]
+    for i, (_, _, _, output_file) in enumerate(outputs):
+        args += ["-map", f"[v{i}]", "-an", *codec_args]
+        if encoder_threads:
+            args += ["-threads", str(encoder_threads)]
+        if segment_seconds:
+            # Keyframes on segment boundaries so the MP4 can be cut into HLS segments without re-encoding
+            args += ["-force_key_frames", f"expr:gte(t,n_forced*{segment_seconds})"]
+        args += ["-pix_fmt", "yuv420p", output_file]
+    if preview_file:
+        args += ["-map", "[preview]", "-loop", "0", preview_file]
+    return args
+
+
+def build_audio_args(audio_file, profile, output_file):
+    return ["-i", audio_file, "-vn", "-c:a", "aac", "-b:a", profile["audio_bitrate"], output_file]
+
+
+def build_mux_args(video_file, audio_file, output_file):
+    # Stream copy both tracks; +faststart moves the moov atom to the front so playback can begin
+    # before the download ends
+    return ["-i", video_file, "-i", audio_file, "-map", "0:v", "-map", "1:a", "-c", "copy",
+            "-movflags", "+faststart", output_file]
+
+
+def package_hls(folder, outputs, duration, timeout=None, deadline=None):
+    # Remuxes each finished rendition into fMP4 HLS segments (stream copy, no re-encode) and writes a
+    # master playlist over them. Returns the master playlist path relative to static/reels.
+    reel_dir = os.path.join(HLS_DIR, folder)
+    shutil.rmtree(reel_dir, ignore_errors=True)
+    variants = []
+    for label, width, height, output_file in outputs:
+        variant_dir = os.path.join(reel_dir, label)
+        os.makedirs(variant_dir, exist_ok=True)
+        run_ffmpeg([
+            "-i", output_file, "-c", "copy", "-f", "hls",
+            "-hls_time", str(HLS_SEGMENT_SECONDS), "-hls_playlist_type", "vod",
+            "-hls_segment_type", "fmp4", "-hls_fmp4_init_filename", "init.mp4",
+            "-hls_segment_filename", os.path.join(variant_dir, "seg_%03d.m4s"),
+            os.path.join(variant_dir, "index.m3u8"),
+        ], timeout=timeout, deadline=deadline)
+        bandwidth = int(os.path.getsize(output_file) * 8 / max(duration, 0.1))
+        variants.append((bandwidth, width, height, f"{label}/index.m3u8"))
+
+    lines = ["#EXTM3U", "#EXT-X-VERSION:7", "#EXT-X-INDEPENDENT-SEGMENTS"]
+    for bandwidth, width, height, uri in variants:
+        lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={width}x{height}")
+        lines.append(uri)
+    master = os.path.join(reel_dir, "master.m3u8")
+    with open(master, "w", encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+    return os.path.relpath(master, os.path.join("static", "reels")).replace(os.sep, "/")
+
+
+def generate_reel(folder, threads=None, timeout=None, preview=None, profile=None, renditions=False,
+                  on_progress=None, hls=None, deadline=None):
+    # timeout bounds the whole render, every stage included; a caller can instead pass a deadline
+    # (ffmpeg_utils.deadline_after) to share one budget with its own stages, such as TTS.
+    # Image durations come from the timeline planner (narration length and dec.txt sentences);
+    # preview also writes a short animated GIF next to the reel (default: REEL_ANIMATED_PREVIEW);
+    # profile names an encoder profile and renditions adds the smaller steps of the output ladder;
+    # on_progress receives ffmpeg's live encode reports (frame, fps, speed, out_time_s, percent);
+    # hls also packages every rendition as segmented HLS (default: REEL_HLS)
+    if cancelled():
+        return False
+    if deadline is None:
+        deadline = deadline_after(timeout)
+    try:
+        profile = encoder_profiles.get_profile(profile)
+    except ValueError as e:
+        logging.error(str(e))
+        return False
+    audio_file = os.path.normpath(os.path.join("user_upload", folder, "audio.mp3"))
+    output_file = os.path.normpath(os.path.join("static", "reels", f"{folder}.mp4"))
+    thumbnail_file = os.path.normpath(os.path.join("static", "reels", "thumbnails", f"{folder}.jpg"))
+    input_file = os.path.normpath(os.path.join("user_upload", folder, "input.txt"))
+
+    # Verify required files
+    if not os.path.exists(audio_file):
+        logging.error(f"Audio file {audio_file} does not exist")
+        return False
+    if not os.path.exists(input_file):
+        logging.error(f"Input file {input_file} does not exist")
+        return False
+
+    # Verify audio file from its headers; TTS leaves a probe sidecar we can reuse
+    with metrics.span("probe", reel=folder) as span:
+        audio_info = media_probe.probe_cached(audio_file)
+        if not media_probe.is_valid_audio(audio_info):
+            logging.error(f"Invalid audio file {audio_file}: {audio_info.get('error', 'no audio stream')}")
+            span.fail()
+            return False
+    logging.info(f"Validated audio file: {audio_file} ({audio_info['duration']:.2f}s)")
+
+    # Verify input.txt content and image files
+    try:
+        entries = read_concat_list(input_file)
+    except Exception as e:
+        logging.error(f"Error reading input file {input_file}: {e}")
+        return False
+    if not entries:
+        logging.error(f"Input file {input_file} lists no images")
+        return False
+    image_paths = [os.path.join("user_upload", folder, image_file) for image_file, _ in entries]
+    for image_path in image_paths:
+        if not os.path.exists(image_path):
+            logging.error(f"Image file {image_path} does not exist")
+            return False
+
+    # Normalize each image to the output canvas once; decoding here also validates it
+    with metrics.span("normalize", reel=folder, images=len(image_paths)) as span:
+        try:
+            normalized = image_prep.normalize_images(image_paths, (profile["width"], profile["height"]),
+                                                     timeout=time_left(deadline))
+        except (FFmpegError, TimeoutError) as e:
+            logging.error(f"Image normalization for {folder} stopped: {e}")
+            span.fail()
+            return False
+        except Exception as e:
+            logging.error(f"Invalid image file in {input_file}: {e}")
+            span.fail()
+            return False
+    logging.info(f"Validated and normalized {len(normalized)} images for {folder}")
+    if cancelled():
+        logging.warning(f"Shutting down, not encoding {folder}")
+        return False
+
+    # Show each image for exactly its share of the narration, cut on sentence boundaries when possible
+    normalized_input_file = os.path.normpath(os.path.join("user_upload", folder, "input.norm.txt"))
+    planned = timeline.build_timeline(normalized, audio_info["duration"], _read_description(folder))
+    write_concat_list(normalized_input_file, planned)
+
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    os.makedirs(os.path.dirname(thumbnail_file), exist_ok=True)
+
+    reels_dir = os.path.dirname(output_file)
+    outputs = [
+        (label, width, height, os.path.join(reels_dir, encoder_profiles.rendition_filename(folder, label, i)))
+        for i, (label, width, height) in enumerate(encoder_profiles.rendition_ladder(profile, renditions))
+    ]
+    if preview is None:
+        preview = ANIMATED_PREVIEW
+    preview_file = None
+    if preview:
+        preview_file = os.path.normpath(os.path.join("static", "reels", "previews", f"{folder}.gif"))
+        os.makedirs(os.path.dirname(preview_file), exist_ok=True)
+    if hls is None:
+        hls = HLS_OUTPUT
+    segment_seconds = HLS_SEGMENT_SECONDS if hls else None
+
+    # Look up the video-only renditions (and preview) for this exact timeline and encoder settings;
+    # whatever is missing is encoded in one pass and added to the render cache
+    video_tracks = []
+    to_encode = []
+    for label, width, height, _ in outputs:
+        key = render_cache.video_key(planned, timeline.FPS, profile, width, height, segment_seconds,
+                                     ffmpeg_caps.video_encoder())
+        cached = render_cache.lookup(key, "mp4", "video")
+        if cached is None:
+            to_encode.append((label, width, height, render_cache.temp_path(key, "mp4"), key, "mp4"))
+            cached = render_cache.artifact_path(key, "mp4")
+        video_tracks.append(cached)
+    preview_track = None
+    preview_temp = None
+    if preview_file:
+        key = render_cache.preview_key(planned, timeline.FPS, PREVIEW_SECONDS, PREVIEW_WIDTH)
+        preview_track = render_cache.lookup(key, "gif", "preview")
+        if preview_track is None:
+            preview_temp = (render_cache.temp_path(key, "gif"), key, "gif")
+            preview_track = render_cache.artifact_path(key, "gif")
+
+    def report_progress(report):
+        metrics.set_gauge("reel_encode_fps", report["fps"])
+        metrics.set_gauge("reel_encode_speed", report["speed"])
+        if on_progress:
+            on_progress(report)
+
+    if to_encode or preview_temp:
+        temps = [(path, key, ext) for _, _, _, path, key, ext in to_encode] + ([preview_temp] if preview_temp else [])
+        with metrics.span("encode", reel=folder, profile=profile["name"], renditions=len(to_encode)) as span:
+            try:
+                run_ffmpeg(
+                    build_encode_args(normalized_input_file, [entry[:4] for entry in to_encode], profile, threads,
+                                      preview_temp[0] if preview_temp else None, segment_seconds),
+                    deadline=deadline,
+                    on_progress=report_progress,
+                    duration=audio_info["duration"],
+                )
+            except FFmpegError as e:
+                logging.error(f"FFmpeg error (reel generation): {e} {e.stderr}")
+                render_cache.discard(path for path, _, _ in temps)
+                span.fail()
+                return False
+        for path, key, ext in temps:
+            render_cache.store(key, path, ext)
+    else:
+        logging.info(f"Video for {folder} unchanged, skipping the encode")
+
+    # The AAC narration track is cached separately, so new images reuse it and new narration reuses the video
+    with metrics.span("audio", reel=folder) as span:
+        key = render_cache.audio_key(audio_file, profile["audio_bitrate"])
+        audio_track = render_cache.lookup(key, "m4a", "audio")
+        if audio_track is None:
+            temp = render_cache.temp_path(key, "m4a")
+            try:
+                run_ffmpeg(build_audio_args(audio_file, profile, temp), deadline=deadline)
+            except FFmpegError as e:
+                logging.error(f"FFmpeg error (audio encode): {e} {e.stderr}")
+                render_cache.discard([temp])
+                span.fail()
+                return False
+            audio_track = render_cache.store(key, temp, "m4a")
+
+    with metrics.span("mux", reel=folder, renditions=len(outputs)) as span:
+        try:
+            for video_track, (_, _, _, path) in zip(video_tracks, outputs):
+                run_ffmpeg(build_mux_args(video_track, audio_track, path), deadline=deadline)
+        except FFmpegError as e:
+            logging.error(f"FFmpeg error (mux): {e} {e.stderr}")
+            span.fail()
+            return False
+    if preview_file:
+        blob_store.link_or_copy(preview_track, preview_file)
+    logging.info(f"Reel generated successfully: {output_file} ({profile['name']}, {len(outputs)} renditions, "
+                 f"{len(to_encode)} encoded)")
+
+    # Verify reel file exists
+    if not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+        logging.error(f"Reel file {output_file} was not created or is empty")
+        return False
+
+    # Thumbnail straight from the normalized first image; no second pass over the finished MP4
+    with metrics.span("thumbnail", reel=folder) as span:
+        try:
+            image_prep.make_thumbnail(normalized[0], thumbnail_file)
+            logging.info(f"Thumbnail generated successfully: {thumbnail_file}")
+        except Exception as e:
+            logging.error(f"Thumbnail generation failed for {folder}: {e}")
+            span.fail()
+            return False
+
+    playlist = None
+    if hls:
+        with metrics.span("hls", reel=folder, renditions=len(outputs)) as span:
+            try:
+                playlist = package_hls(folder, outputs, audio_info["duration"], deadline=deadline)
+                logging.info(f"HLS playlist generated successfully: {playlist}")
+            except FFmpegError as e:
+                # The progressive MP4 is already there, so the reel is still usable
+                logging.error(f"FFmpeg error (HLS packaging): {e} {e.stderr}")
+                span.fail()
+
+    try:
+        gallery_index.add_reel(folder, renditions=[
+            {"label": label, "width": width, "height": height, "file": os.path.basename(path)}
+            for label, width, height, path in outputs
+        ], playlist=playlist)
+    except Exception as e:
+        logging.error(f"Failed to add reel {folder} to the gallery index: {e}")
+    return True
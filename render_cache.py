@@ -0,0 +1,88 @@
+import os
+import json
+import uuid
+import hashlib
+import logging
+import metrics
+
+# Content-addressed cache of intermediate render artifacts. Video-only renditions are keyed on the
+# planned timeline (normalized image hashes and durations), the encoder settings and the output
+# size; the AAC narration track on the audio bytes and bitrate. A reel whose images and timing are
+# unchanged reuses its encoded video, and the final MP4 is a stream-copy mux of the two tracks.
+RENDER_CACHE_DIR = os.environ.get("RENDER_CACHE_DIR", os.path.join("cache", "renders"))
+KEY_VERSION = 1  # Bump when the encode arguments change in a way the key doesn't capture
+
+
+def _digest(payload):
+    encoded = json.dumps([KEY_VERSION, payload], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def timeline_fingerprint(entries, fps):
+    # Normalized images are named after their content hash and canvas, so basenames identify them
+    return [[os.path.basename(path), duration] for path, duration in entries] + [fps]
+
+
+def video_key(entries, fps, profile, width, height, segment_seconds=None, encoder="libx264"):
+    return _digest({
+        "timeline": timeline_fingerprint(entries, fps),
+        "encoder": encoder, "preset": profile["preset"], "crf": profile["crf"],
+        "video_bitrate": profile.get("video_bitrate"),
+        "canvas": [profile["width"], profile["height"]], "size": [width, height],
+        "segment_seconds": segment_seconds,
+    })
+
+
+def preview_key(entries, fps, seconds, width):
+    return _digest({"timeline": timeline_fingerprint(entries, fps), "preview": [seconds, width]})
+
+
+def audio_key(audio_path, bitrate):
+    return _digest({"audio": _file_hash(audio_path), "bitrate": bitrate})
+
+
+def artifact_path(key, ext):
+    return os.path.join(RENDER_CACHE_DIR, key[:2], f"{key}.{ext}")
+
+
+def temp_path(key, ext):
+    # Keeps the real extension last so ffmpeg picks the right muxer
+    directory = os.path.dirname(artifact_path(key, ext))
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f".{key}.{uuid.uuid4().hex}.tmp.{ext}")
+
+
+def lookup(key, ext, kind):
+    path = artifact_path(key, ext)
+    try:
+        # Bump mtime so eviction treats this artifact as recently used
+        os.utime(path)
+    except FileNotFoundError:
+        metrics.inc("render_cache_lookups_total", kind=kind, result="miss")
+        return None
+    metrics.inc("render_cache_lookups_total", kind=kind, result="hit")
+    logging.info(f"Reusing cached {kind} artifact {path}")
+    return path
+
+
+def store(key, src_path, ext):
+    path = artifact_path(key, ext)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(src_path, path)
+    return path
+
+
+def discard(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
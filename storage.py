@@ -0,0 +1,358 @@
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+import threading
+import job_store
+import blob_store
+import tts_cache
+import image_prep
+import render_cache
+import gallery_index
+import metrics
+
+# Storage lifecycle: per-category TTLs and size quotas over everything the pipeline leaves on disk.
+# An index in the jobs database remembers each item's size and last use, and directories are only
+# re-listed when their mtime changes, so a sweep costs a stat per directory rather than a full walk.
+# Only things that can be regenerated or are no longer needed are ever deleted:
+#   uploads       user_upload/<id> folders whose job finished, or that sat pending past the TTL
+#   blobs         uploaded images no upload folder links to any more
+#   *_cache       TTS audio, normalized images and render artifacts, least recently used first
+#   reels         files under static/reels whose reel is no longer in the gallery
+DAY = 24 * 3600
+GB = 1024 ** 3
+SWEEP_INTERVAL = int(os.environ.get("STORAGE_SWEEP_INTERVAL", "3600"))  # 0 disables background sweeps
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS storage_items (
+    path TEXT PRIMARY KEY,
+    category TEXT NOT NULL,
+    parent TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_storage_lru ON storage_items (category, last_used);
+CREATE INDEX IF NOT EXISTS idx_storage_parent ON storage_items (parent);
+CREATE TABLE IF NOT EXISTS storage_dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+"""
+
+
+def _policy(name, ttl, max_bytes):
+    # STORAGE_<NAME>_TTL (seconds) and STORAGE_<NAME>_MAX_BYTES override the defaults; 0 disables a limit
+    prefix = f"STORAGE_{name.upper()}"
+    return {
+        "ttl": int(os.environ.get(f"{prefix}_TTL", str(ttl))),
+        "max_bytes": int(os.environ.get(f"{prefix}_MAX_BYTES", str(max_bytes))),
+    }
+
+
+# locations: (directory, layout). "files" indexes the files in a directory, "shards" the files one
+# level down (the caches' xx/ fan-out) and "folders" treats each subdirectory as a single item.
+CATEGORIES = {
+    "uploads": dict(_policy("uploads", 7 * DAY, 5 * GB), locations=[("user_upload", "folders")]),
+    "blobs": dict(_policy("blobs", 7 * DAY, 5 * GB), locations=[(blob_store.BLOB_DIR, "shards")]),
+    "tts_cache": dict(_policy("tts_cache", 30 * DAY, tts_cache.TTS_CACHE_MAX_BYTES),
+                      locations=[(tts_cache.TTS_CACHE_DIR, "shards")]),
+    "image_cache": dict(_policy("image_cache", 14 * DAY, 2 * GB), locations=[(image_prep.IMAGE_CACHE_DIR, "shards")]),
+    "render_cache": dict(_policy("render_cache", 14 * DAY, 5 * GB),
+                         locations=[(render_cache.RENDER_CACHE_DIR, "shards")]),
+    "reels": dict(_policy("reels", 1 * DAY, 0), locations=[
+        (gallery_index.REELS_DIR, "files"),
+        (os.path.join(gallery_index.REELS_DIR, "thumbnails"), "files"),
+        (os.path.join(gallery_index.REELS_DIR, "previews"), "files"),
+        (os.path.join(gallery_index.REELS_DIR, "hls"), "folders"),
+    ]),
+}
+
+_schema_ready = set()
+_sweeper = None
+
+
+def get_connection(db_path=None):
+    conn = job_store.get_connection(db_path)
+    key = db_path or job_store.JOB_DB_PATH
+    if key not in _schema_ready:
+        conn.executescript(SCHEMA)
+        _schema_ready.add(key)
+    return conn
+
+
+def _folder_usage(path):
+    # (total bytes, newest mtime) of everything under path
+    size, newest = 0, 0.0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            size += st.st_size
+            newest = max(newest, st.st_mtime)
+    return size, newest
+
+
+def _dir_changed(conn, path):
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        mtime_ns = -1
+    row = conn.execute("SELECT mtime_ns FROM storage_dirs WHERE path = ?", (path,)).fetchone()
+    if row and row["mtime_ns"] == mtime_ns:
+        return False
+    conn.execute("INSERT INTO storage_dirs (path, mtime_ns) VALUES (?, ?) "
+                 "ON CONFLICT(path) DO UPDATE SET mtime_ns = excluded.mtime_ns", (path, mtime_ns))
+    return True
+
+
+def _index_files(conn, category, directory):
+    # Re-lists directory only when its mtime says entries were added or removed
+    if not _dir_changed(conn, directory):
+        return
+    rows = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # Dotfiles are in-progress temp files owned by a writer
+                if entry.name.startswith(".") or not entry.is_file(follow_symlinks=False):
+                    continue
+                st = entry.stat()
+                rows.append((entry.path, category, directory, st.st_size, st.st_mtime, st.st_mtime_ns))
+    except FileNotFoundError:
+        pass
+    conn.execute("DELETE FROM storage_items WHERE parent = ?", (directory,))
+    conn.executemany("INSERT OR REPLACE INTO storage_items VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+
+def _index_folders(conn, category, directory):
+    # One stat per folder; a folder is only walked again when its own mtime moves
+    known = {row["path"]: row["mtime_ns"] for row in conn.execute(
+        "SELECT path, mtime_ns FROM storage_items WHERE parent = ?", (directory,))}
+    seen = set()
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.is_dir(follow_symlinks=False):
+                    continue
+                seen.add(entry.path)
+                mtime_ns = entry.stat().st_mtime_ns
+                if known.get(entry.path) == mtime_ns:
+                    continue
+                size, newest = _folder_usage(entry.path)
+                conn.execute("INSERT OR REPLACE INTO storage_items VALUES (?, ?, ?, ?, ?, ?)",
+                             (entry.path, category, directory, size, max(newest, mtime_ns / 1e9), mtime_ns))
+    except FileNotFoundError:
+        pass
+    gone = [(path,) for path in known if path not in seen]
+    conn.executemany("DELETE FROM storage_items WHERE path = ?", gone)
+
+
+def refresh_index(categories=None, db_path=None):
+    conn = get_connection(db_path)
+    for name in categories or CATEGORIES:
+        for directory, layout in CATEGORIES[name]["locations"]:
+            # The index code reads before it writes, so take the write lock up front: upgrading a
+            # deferred transaction fails at once if a worker committed in between
+            with job_store.immediate(conn):
+                if layout == "files":
+                    _index_files(conn, name, directory)
+                elif layout == "folders":
+                    _index_folders(conn, name, directory)
+                else:
+                    try:
+                        with os.scandir(directory) as entries:
+                            shards = [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+                    except FileNotFoundError:
+                        shards = []
+                    for shard in shards:
+                        _index_files(conn, name, shard)
+                    # Forget shards that disappeared entirely
+                    known = {row["parent"] for row in conn.execute(
+                        "SELECT DISTINCT parent FROM storage_items WHERE category = ?", (name,))}
+                    conn.executemany("DELETE FROM storage_items WHERE parent = ?",
+                                     [(parent,) for parent in known - set(shards)])
+
+
+def _reel_id(path):
+    # static/reels/<id>.mp4, <id>_<label>.mp4, thumbnails/<id>.jpg, previews/<id>.gif, hls/<id>/
+    name = os.path.basename(path)
+    if os.path.dirname(path) == os.path.join(gallery_index.REELS_DIR, "hls"):
+        return name
+    stem = os.path.splitext(name)[0]
+    base, _, label = stem.rpartition("_")
+    return base if base and label.endswith("p") and label[:-1].isdigit() else stem
+
+
+def _protection(name, now, db_path=None):
+    # Returns is_protected(item) for the category; protected items count towards the quota
+    # but are never deleted
+    if name == "uploads":
+        ttl = CATEGORIES["uploads"]["ttl"]
+
+        def is_protected(item):
+            job = job_store.get_job(os.path.basename(item["path"]), db_path)
+            if job is None:
+                return False  # Abandoned upload that never became a job
+            if job["status"] == "running":
+                return (job["lease_expires"] or 0) > now  # A live lease means a render is in progress
+            if job["status"] == "pending":
+                # Incomplete uploads stay pending for ever (workers release them on every poll), so a
+                # pending folder whose files haven't changed within the TTL is treated as abandoned
+                return not ttl or item["last_used"] >= now - ttl
+            return False
+        return is_protected
+    if name == "blobs":
+        def is_protected(item):
+            try:
+                return os.stat(item["path"]).st_nlink > 1  # Still hard-linked into an upload folder
+            except FileNotFoundError:
+                return False
+        return is_protected
+    if name == "reels":
+        referenced = {row["id"] for row in gallery_index.get_connection(db_path).execute("SELECT id FROM reels")}
+        return lambda item: _reel_id(item["path"]) in referenced
+    return lambda item: False
+
+
+def _still_unused(conn, item):
+    # The index can lag behind cache hits (they bump mtime, not the directory), so re-check first
+    try:
+        st = os.stat(item["path"])
+    except FileNotFoundError:
+        conn.execute("DELETE FROM storage_items WHERE path = ?", (item["path"],))
+        return False
+    if not os.path.isdir(item["path"]) and st.st_mtime > item["last_used"] + 1:
+        conn.execute("UPDATE storage_items SET last_used = ?, size = ? WHERE path = ?",
+                     (st.st_mtime, st.st_size, item["path"]))
+        return False
+    return True
+
+
+def _retire_upload(folder, db_path=None):
+    # A deleted upload can never render, so stop workers from claiming and releasing it for ever
+    job = job_store.get_job(folder, db_path)
+    if job is not None and job["status"] != "done":
+        job_store.mark_failed(folder, "upload removed by storage sweep", 1, db_path=db_path)
+
+
+def _delete(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def sweep(dry_run=False, categories=None, now=None, db_path=None):
+    # Applies every category's TTL, then its quota (oldest first). Returns a report per category;
+    # with dry_run nothing is deleted and the report lists what would have been.
+    now = now or time.time()
+    if "reels" in (categories or CATEGORIES):
+        # Reel protection reads the gallery index, so make sure reels rendered before the index
+        # existed are in it; a no-op after the first run
+        gallery_index.backfill_from_disk(db_path)
+    refresh_index(categories, db_path)
+    conn = get_connection(db_path)
+    report = {}
+    for name in categories or CATEGORIES:
+        policy = CATEGORIES[name]
+        items = [dict(row) for row in conn.execute(
+            "SELECT path, size, last_used FROM storage_items WHERE category = ? ORDER BY last_used", (name,))]
+        total = sum(item["size"] for item in items)
+        is_protected = _protection(name, now, db_path)
+        entry = {"items": len(items), "bytes": total, "ttl": policy["ttl"], "max_bytes": policy["max_bytes"],
+                 "protected": 0, "deleted": [], "freed_bytes": 0}
+        for item in items:
+            expired = bool(policy["ttl"]) and item["last_used"] < now - policy["ttl"]
+            over_quota = bool(policy["max_bytes"]) and total > policy["max_bytes"]
+            if not expired and not over_quota:
+                break  # Oldest first, so nothing further down has expired either
+            if is_protected(item):
+                entry["protected"] += 1
+                continue
+            if not _still_unused(conn, item):
+                continue
+            entry["deleted"].append({"path": item["path"], "size": item["size"],
+                                     "reason": "ttl" if expired else "quota"})
+            entry["freed_bytes"] += item["size"]
+            total -= item["size"]
+            if not dry_run:
+                _delete(item["path"])
+                conn.execute("DELETE FROM storage_items WHERE path = ?", (item["path"],))
+                if name == "uploads":
+                    _retire_upload(os.path.basename(item["path"]), db_path)
+        if entry["deleted"] and not dry_run:
+            metrics.inc("storage_evictions_total", len(entry["deleted"]), category=name)
+            metrics.inc("storage_freed_bytes_total", entry["freed_bytes"], category=name)
+            logging.info(f"Storage sweep freed {entry['freed_bytes']} bytes from {name} "
+                         f"({len(entry['deleted'])} items)")
+        metrics.set_gauge("storage_bytes", total, category=name)
+        report[name] = entry
+    return report
+
+
+def _claim_sweep(interval, db_path=None):
+    # Only one process (web app or worker) sweeps per interval
+    conn = job_store.get_connection(db_path)
+    now = time.time()
+    with job_store.immediate(conn):
+        row = conn.execute("SELECT value FROM meta WHERE key = 'storage_next_sweep'").fetchone()
+        if row and float(row["value"]) > now:
+            return False
+        conn.execute("INSERT INTO meta (key, value) VALUES ('storage_next_sweep', ?) "
+                     "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (str(now + interval),))
+    return True
+
+
+def start_sweeper(interval=SWEEP_INTERVAL):
+    # Background thread that runs an incremental sweep every interval seconds
+    global _sweeper
+    if not interval or _sweeper is not None:
+        return None
+
+    def loop():
+        while True:
+            try:
+                if _claim_sweep(interval):
+                    sweep()
+            except Exception as e:
+                logging.error(f"Storage sweep failed: {e}")
+                # Let the next wake-up (in this or another process) try again instead of waiting an interval
+                job_store.set_meta("storage_next_sweep", 0)
+            time.sleep(min(interval, 300))
+
+    _sweeper = threading.Thread(target=loop, name="storage-sweeper", daemon=True)
+    _sweeper.start()
+    return _sweeper
+
+
+def format_report(report, dry_run):
+    lines = []
+    for name, entry in report.items():
+        quota = f"{entry['max_bytes'] / GB:.2f}GB" if entry["max_bytes"] else "none"
+        ttl = f"{entry['ttl'] / DAY:g}d" if entry["ttl"] else "none"
+        action = "would free" if dry_run else "freed"
+        lines.append(f"{name:14s} {entry['items']:7d} items {entry['bytes'] / 1024 ** 2:10.1f}MB  quota {quota:>8s}  "
+                     f"ttl {ttl:>5s}  {action} {entry['freed_bytes'] / 1024 ** 2:.1f}MB in {len(entry['deleted'])} "
+                     f"items, {entry['protected']} protected")
+        for deleted in entry["deleted"]:
+            lines.append(f"    {deleted['reason']:5s} {deleted['size']:>12d}  {deleted['path']}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Apply storage quotas and TTLs")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be deleted without deleting")
+    parser.add_argument("--category", action="append", choices=sorted(CATEGORIES), help="Limit to these categories")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+    result = sweep(dry_run=args.dry_run, categories=args.category)
+    print(json.dumps(result, indent=2) if args.json else format_report(result, args.dry_run))
@@ -1,12 +1,225 @@
 import os
+import time
 import logging
-from gtts import gTTS
-from pydub import AudioSegment
+import threading
+import subprocess
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import tts_cache
+import media_probe
+import blob_store
+import metrics
+import timeline
+from ffmpeg_utils import run_ffmpeg, FFmpegError, cap_timeout
 
-# Setup logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Long descriptions are synthesized as sentence-aligned chunks of at most TTS_CHUNK_CHARS, up to
+# TTS_CHUNK_WORKERS at a time per process, and joined by stream copy. Each chunk is cached on its
+# own and retried on its own, so one transient failure doesn't throw away the rest of the narration.
+TTS_CHUNK_CHARS = int(os.environ.get("TTS_CHUNK_CHARS", "500"))
+TTS_CHUNK_WORKERS = int(os.environ.get("TTS_CHUNK_WORKERS", "4"))
+TTS_CHUNK_RETRIES = 3
+TTS_RETRY_BACKOFF = 1.0  # Seconds before the first retry, doubled after each failure
 
-def text_to_speech_with_gtts(input_text, folder, lang='en-us'):
+
+class TTSBackend(ABC):
+    # A TTS engine writes an MP3 for the given text to output_path or raises on failure.
+    name = None
+
+    @abstractmethod
+    def synthesize(self, text, output_path, lang, tld, timeout=None):
+        pass
+
+
+class GTTSBackend(TTSBackend):
+    name = "gtts"
+
+    def synthesize(self, text, output_path, lang, tld, timeout=None):
+        # Imported on first use; gTTS pulls in requests and friends, which most processes never need
+        from gtts import gTTS
+        tts = gTTS(text=text, lang=lang, tld=tld, slow=False, timeout=timeout)
+        tts.save(output_path)
+
+
+class EspeakBackend(TTSBackend):
+    # Offline synthesis for air-gapped hosts: espeak-ng renders WAV, ffmpeg encodes it to MP3
+    name = "espeak"
+
+    def synthesize(self, text, output_path, lang, tld, timeout=None):
+        voice = lang.split("-")[0]
+        wav = subprocess.run(
+            ["espeak-ng", "-v", voice, "--stdout", text],
+            capture_output=True, check=True, timeout=timeout,
+        ).stdout
+        subprocess.run(
+            ["ffmpeg", "-y", "-f", "wav", "-i", "pipe:0", "-c:a", "libmp3lame", "-q:a", "4", output_path],
+            input=wav, capture_output=True, check=True, timeout=timeout,
+        )
+
+
+class StubBackend(TTSBackend):
+    # Deterministic tone whose length tracks the word count, for tests and benchmarks without network
+    name = "stub"
+    seconds_per_word = 0.4
+
+    def synthesize(self, text, output_path, lang, tld, timeout=None):
+        duration = max(1.0, len(text.split()) * self.seconds_per_word)
+        subprocess.run(
+            ["ffmpeg", "-y", "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration:.2f}",
+             "-c:a", "libmp3lame", "-q:a", "4", output_path],
+            capture_output=True, check=True, timeout=timeout,
+        )
+
+
+TTS_BACKENDS = {backend.name: backend for backend in (GTTSBackend, EspeakBackend, StubBackend)}
+_backend = None
+_chunk_pool = None
+_chunk_pool_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        name = os.environ.get("TTS_BACKEND", "gtts")
+        if name not in TTS_BACKENDS:
+            raise ValueError(f"Unknown TTS backend {name!r}, expected one of {sorted(TTS_BACKENDS)}")
+        _backend = TTS_BACKENDS[name]()
+    return _backend
+
+
+def set_backend(backend):
+    # Accepts a backend name or a TTSBackend instance
+    global _backend
+    _backend = TTS_BACKENDS[backend]() if isinstance(backend, str) else backend
+
+
+def synthesize_cached(input_text, lang, tld, timeout=None):
+    # Returns the path of a validated cached MP3 for the text, synthesizing it on a miss
+    backend = get_backend()
+    key = tts_cache.cache_key(input_text, lang, tld, backend.name)
+    cached = tts_cache.lookup(key)
+    if cached:
+        logging.info(f"TTS cache hit for {key[:12]}")
+        return cached
+
+    tmp_path = tts_cache.temp_path(key)
+    try:
+        backend.synthesize(input_text, tmp_path, lang, tld, timeout=timeout)
+        if not os.path.exists(tmp_path) or os.path.getsize(tmp_path) == 0:
+            logging.error(f"{backend.name} produced an empty audio file")
+            return None
+        info = media_probe.probe(tmp_path)
+        if not media_probe.is_valid_audio(info):
+            logging.error(f"Invalid MP3 file generated: {info.get('error', 'no audio stream')}")
+            return None
+        return tts_cache.store(key, tmp_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def split_text(text, max_chars=TTS_CHUNK_CHARS):
+    # Packs whole sentences into chunks of at most max_chars; an overlong sentence is split on words
+    chunks = []
+    current = ""
+    for sentence in timeline.split_sentences(text):
+        pieces = []
+        for word in sentence.split():
+            if pieces and len(pieces[-1]) + 1 + len(word) <= max_chars:
+                pieces[-1] = f"{pieces[-1]} {word}"
+            else:
+                pieces.append(word)
+        for piece in pieces:
+            if current and len(current) + 1 + len(piece) <= max_chars:
+                current = f"{current} {piece}"
+            else:
+                if current:
+                    chunks.append(current)
+                current = piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _get_chunk_pool():
+    global _chunk_pool
+    with _chunk_pool_lock:
+        if _chunk_pool is None:
+            _chunk_pool = ThreadPoolExecutor(max_workers=TTS_CHUNK_WORKERS, thread_name_prefix="tts-chunk")
+        return _chunk_pool
+
+
+def synthesize_chunk(text, lang, tld, timeout=None, deadline=None):
+    # synthesize_cached with retries and exponential backoff; raises once every attempt failed or
+    # deadline (ffmpeg_utils.deadline_after) has passed
+    error = None
+    for attempt in range(1, TTS_CHUNK_RETRIES + 1):
+        attempt_timeout = cap_timeout(timeout, deadline)
+        try:
+            path = synthesize_cached(text, lang, tld, timeout=attempt_timeout)
+            if path:
+                metrics.inc("tts_chunks_total", result="ok" if attempt == 1 else "retried")
+                return path
+            error = "invalid audio"
+        except Exception as e:
+            error = e
+        logging.warning(f"TTS chunk attempt {attempt}/{TTS_CHUNK_RETRIES} failed: {error}")
+        if attempt < TTS_CHUNK_RETRIES:
+            time.sleep(TTS_RETRY_BACKOFF * 2 ** (attempt - 1))
+    metrics.inc("tts_chunks_total", result="failed")
+    raise RuntimeError(f"TTS failed after {TTS_CHUNK_RETRIES} attempts: {error}")
+
+
+def _concat_audio(paths, output_path, timeout=None, deadline=None):
+    # Chunks come from the same backend and settings, so the concat demuxer can join them without
+    # re-encoding; fall back to an MP3 re-encode if their parameters don't line up
+    list_path = f"{output_path}.txt"
+    with open(list_path, "w", encoding='utf-8') as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    try:
+        try:
+            run_ffmpeg(["-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", output_path],
+                       timeout=timeout, deadline=deadline)
+        except FFmpegError as e:
+            logging.warning(f"Stream-copy concat of TTS chunks failed, re-encoding: {e}")
+            run_ffmpeg(["-f", "concat", "-safe", "0", "-i", list_path, "-c:a", "libmp3lame", "-q:a", "4",
+                        output_path], timeout=timeout, deadline=deadline)
+    finally:
+        os.remove(list_path)
+
+
+def synthesize_long(input_text, lang, tld, timeout=None, deadline=None):
+    # Returns the cached MP3 for the whole text, built from concurrently synthesized chunks on a miss
+    chunks = split_text(input_text)
+    if len(chunks) <= 1:
+        return synthesize_chunk(input_text, lang, tld, timeout=timeout, deadline=deadline)
+
+    backend = get_backend()
+    key = tts_cache.cache_key(input_text, lang, tld, backend.name)
+    cached = tts_cache.lookup(key)
+    if cached:
+        logging.info(f"TTS cache hit for {key[:12]}")
+        return cached
+
+    logging.info(f"Synthesizing {len(chunks)} TTS chunks with up to {TTS_CHUNK_WORKERS} in parallel")
+    paths = list(_get_chunk_pool().map(
+        lambda chunk: synthesize_chunk(chunk, lang, tld, timeout, deadline), chunks))
+    tmp_path = tts_cache.temp_path(key)
+    try:
+        _concat_audio(paths, tmp_path, timeout=timeout, deadline=deadline)
+        info = media_probe.probe(tmp_path)
+        if not media_probe.is_valid_audio(info):
+            logging.error(f"Invalid joined MP3 file: {info.get('error', 'no audio stream')}")
+            return None
+        return tts_cache.store(key, tmp_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def text_to_speech_with_gtts(input_text, folder, lang='en-us', tld='com', timeout=None, deadline=None):
+    # timeout applies to each request; deadline (ffmpeg_utils.deadline_after) bounds the whole call
     if not isinstance(input_text, str) or not input_text.strip():
         logging.error("Invalid input: Text must be a non-empty string")
         return None
@@ -17,26 +230,19 @@ def text_to_speech_with_gtts(input_text, folder, lang='en-us'):
 
     logging.info(f"Generating audio for text: {input_text[:50]}... in folder {folder}")
 
-    try:
-        tts = gTTS(text=input_text, lang=lang, slow=False)
-        tts.save(output_filepath)
-        if os.path.exists(output_filepath) and os.path.getsize(output_filepath) > 0:
-            try:
-                AudioSegment.from_mp3(output_filepath)
-                logging.info(f"Audio file {output_filepath} generated successfully")
-                return output_filepath
-            except Exception as e:
-                logging.error(f"Invalid MP3 file generated: {e}")
-                if os.path.exists(output_filepath):
-                    os.remove(output_filepath)
+    with metrics.span("tts", reel=folder, chars=len(input_text)) as span:
+        try:
+            cached = synthesize_long(input_text, lang, tld, timeout=timeout, deadline=deadline)
+            if not cached:
+                span.fail()
                 return None
-        else:
-            logging.error(f"Audio file {output_filepath} is empty or does not exist")
-            if os.path.exists(output_filepath):
-                os.remove(output_filepath)
+            # The per-folder audio.mp3 is a hard link (or copy) of the cached artifact
+            blob_store.link_or_copy(cached, output_filepath)
+            # Probe once here; later stages read the sidecar instead of decoding the MP3 again
+            media_probe.probe_cached(output_filepath)
+            logging.info(f"Audio file {output_filepath} generated successfully")
+            return output_filepath
+        except Exception as e:
+            logging.error(f"TTS error: {e}, folder: {folder}")
+            span.fail()
             return None
-    except Exception as e:
-        logging.error(f"gTTS error: {e}")
-        if os.path.exists(output_filepath):
-            os.remove(output_filepath)
-        return None
\ No newline at end of file
@@ -0,0 +1,73 @@
+import re
+import logging
+
+# Plans how long each image stays on screen so the slideshow ends exactly when the narration does.
+# Durations are whole frames at FPS, and cuts are snapped to sentence boundaries of the description
+# when there are enough sentences to go round.
+FPS = 30
+MIN_IMAGE_SECONDS = 1.0
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_sentences(text):
+    return [s.strip() for s in _SENTENCE_END.split(text or "") if s.strip()]
+
+
+def sentence_boundaries(text, audio_duration):
+    # Estimated end time of each sentence, assuming narration time is proportional to its length
+    sentences = split_sentences(text)
+    total = sum(len(s) for s in sentences)
+    if not total:
+        return []
+    boundaries = []
+    elapsed = 0
+    for sentence in sentences:
+        elapsed += len(sentence)
+        boundaries.append(audio_duration * elapsed / total)
+    return boundaries
+
+
+def plan_durations(image_count, audio_duration, text=None, fps=FPS):
+    # Per-image durations in seconds, frame-aligned, summing to the narration length
+    if image_count <= 0:
+        return []
+    total_frames = max(image_count, round(audio_duration * fps))
+    even = [total_frames * (i + 1) / image_count for i in range(image_count - 1)]
+
+    cuts = even
+    boundaries = [round(t * fps) for t in sentence_boundaries(text, audio_duration)[:-1]] if text else []
+    if len(boundaries) >= image_count - 1 > 0:
+        # Snap each even cut to the nearest unused sentence boundary, keeping cuts strictly increasing
+        # and every image on screen for at least MIN_IMAGE_SECONDS
+        min_frames = max(1, min(round(MIN_IMAGE_SECONDS * fps), total_frames // image_count))
+        snapped = []
+        previous = 0
+        for i, target in enumerate(even):
+            remaining = image_count - 1 - i
+            candidates = [b for b in boundaries
+                          if b - previous >= min_frames and total_frames - b >= min_frames * remaining]
+            if not candidates:
+                snapped = None
+                break
+            cut = min(candidates, key=lambda b: abs(b - target))
+            snapped.append(cut)
+            previous = cut
+            boundaries = [b for b in boundaries if b > cut]
+        if snapped:
+            cuts = snapped
+
+    edges = [0] + [round(c) for c in cuts] + [total_frames]
+    return [(edges[i + 1] - edges[i]) / fps for i in range(image_count)]
+
+
+def build_timeline(image_paths, audio_duration, text=None, fps=FPS):
+    # Concat demuxer entries. The last image is listed twice because ffmpeg ignores the
+    # duration of the final entry otherwise.
+    durations = plan_durations(len(image_paths), audio_duration, text, fps)
+    entries = list(zip(image_paths, durations))
+    if entries:
+        entries.append((image_paths[-1], None))
+    logging.info(f"Planned timeline: {len(image_paths)} images over {sum(durations):.3f}s "
+                 f"({', '.join(f'{d:.2f}' for d in durations)})")
+    return entries
@@ -0,0 +1,115 @@
+import os
+import json
+import uuid
+import hashlib
+import logging
+import threading
+import unicodedata
+import metrics
+
+# Content-addressed cache of synthesized audio, shared by the web app and the workers.
+# Entries are keyed on (normalized text, lang, tld, backend) and evicted least recently used
+# first once the directory grows past TTS_CACHE_MAX_BYTES.
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", os.path.join("cache", "tts"))
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+_lock = threading.Lock()
+_size_estimate = None
+
+
+def normalize_text(text):
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(text, lang, tld, backend):
+    payload = json.dumps([normalize_text(text), lang, tld, backend], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def cache_path(key, ext="mp3"):
+    return os.path.join(TTS_CACHE_DIR, key[:2], f"{key}.{ext}")
+
+
+def temp_path(key, ext="mp3"):
+    # Unique scratch path inside the cache dir, so the final os.replace() is atomic
+    directory = os.path.dirname(cache_path(key, ext))
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f".{key}.{uuid.uuid4().hex}.tmp.{ext}")
+
+
+def lookup(key, ext="mp3"):
+    path = cache_path(key, ext)
+    try:
+        # Bump mtime so eviction treats this entry as recently used
+        os.utime(path)
+    except FileNotFoundError:
+        with _lock:
+            _stats["misses"] += 1
+        metrics.inc("tts_cache_lookups_total", result="miss")
+        return None
+    with _lock:
+        _stats["hits"] += 1
+    metrics.inc("tts_cache_lookups_total", result="hit")
+    return path
+
+
+def store(key, src_path, ext="mp3"):
+    # Moves a freshly synthesized file into the cache and returns the cached path
+    global _size_estimate
+    path = cache_path(key, ext)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    size = os.path.getsize(src_path)
+    os.replace(src_path, path)
+    with _lock:
+        _stats["stores"] += 1
+        if _size_estimate is not None:
+            _size_estimate += size
+        over_budget = _size_estimate is None or _size_estimate > TTS_CACHE_MAX_BYTES
+    if over_budget:
+        evict()
+    return path
+
+
+def evict(max_bytes=None):
+    global _size_estimate
+    max_bytes = TTS_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    total = 0
+    for root, _, files in os.walk(TTS_CACHE_DIR):
+        for name in files:
+            if name.startswith("."):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    removed = 0
+    if total > max_bytes:
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+            if total <= max_bytes:
+                break
+        logging.info(f"Evicted {removed} entries from TTS cache, {total} bytes remain")
+    with _lock:
+        _size_estimate = total
+        _stats["evictions"] += removed
+    if removed:
+        metrics.inc("tts_cache_evictions_total", removed)
+    return removed
+
+
+def get_stats():
+    with _lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats